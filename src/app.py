@@ -1,44 +1,25 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
 import time
-import threading
-import plotly.graph_objects as go
-
-# Import our Layers
-from mock_stream import VitalStream
-from layer_1_tda import TopologicalSensor
-from layer_2_pinn import HemodynamicPINN
-from layer_3_kan import PhysicsInformedKAN
-import importlib
-import layer_4_agent
-importlib.reload(layer_4_agent) # FORCE RELOAD to fix stale cache
-from layer_4_agent import MedGemmaAgent
+
+# Import our Layers (once per server process: Streamlit keeps them in sys.modules
+# across reruns; torch / giotto-tda / plotly are imported on first use)
+from live_worker import PipelineWorker
+
+# UI refresh rate, independent of the compute tick rate
+FRAME_SECONDS = 0.1
 
 st.set_page_config(page_title="MedGemma Triage Copilot", layout="wide")
 
-if "tpt_system" not in st.session_state:
-    st.session_state.tpt_system = {
-        "stream": VitalStream(csv_path="data/mock_vitals_v2.csv"),
-        "tda": TopologicalSensor(),
-        "pinn": HemodynamicPINN(),
-        "kan": PhysicsInformedKAN(),
-        "agent": MedGemmaAgent()
-    }
-    st.session_state.history = {
-        "HR": [], "MAP": [], "Shape": [], "Risk": [], "RR": []
-    }
-    st.session_state.logs = []
+if "worker" not in st.session_state or st.session_state.worker.expired:
+    # Layers 1-4 run on the worker's thread; this script only renders its snapshots.
+    # The worker pauses itself when this session stops reading (tab closed) and
+    # exits after a long idle, in which case the next rerun starts a fresh one.
+    st.session_state.worker = PipelineWorker(csv_path="data/mock_vitals_v2.csv", tick_delay=0.08)
     st.session_state.running = False
+    st.session_state.last_toast_seq = 0
 
-# Ensure Async State exists
-if "is_analyzing" not in st.session_state:
-    st.session_state.is_analyzing = False
-    st.session_state.analysis_result = None
-    st.session_state.last_trigger_time = 0
-    # Stability State
-    st.session_state.last_alert_time = 0
-    st.session_state.latched_decision = None
+worker = st.session_state.worker
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -52,13 +33,14 @@ with st.sidebar:
     st.header("🧠 Agent Config")
     model_id_input = st.text_input("Model ID", value="google/gemma-2b-it")
     
-    if model_id_input != st.session_state.tpt_system["agent"].real_engine.model_id:
-         st.session_state.tpt_system["agent"].real_engine.model_id = model_id_input
-         st.session_state.tpt_system["agent"].real_engine.is_loaded = False 
+    if model_id_input != worker.agent.real_engine.model_id:
+         worker.agent.real_engine.model_id = model_id_input
+         worker.agent.real_engine.is_loaded = False 
          st.toast(f"Model switched to {model_id_input}")
 
-    run_deep_analysis = st.button("Run Deep Analysis (Real Model)")
-    enable_auto_analysis = st.toggle("⚡ Enable Auto-Copilot", value=True)
+    if st.button("Run Deep Analysis (Real Model)"):
+        worker.request_analysis()
+    worker.auto_analysis = st.toggle("⚡ Enable Auto-Copilot", value=True)
 
 # --- HEADER (The Hook) ---
 st.title("MedGemma: The Triage Copilot")
@@ -91,147 +73,94 @@ with st.expander("Show Topological & Physics Evidence", expanded=True):
         chart_shape = st.empty()
 
 
-# --- SIMULATION LOOP ---
-if st.session_state.running:
-    system = st.session_state.tpt_system
-    
-    # Process 1 step at a time for clarity
-    for chunk_idx, chunk_data in enumerate(system["stream"].stream(chunk_size=1, delay=0.08)):
-        
-        # 0. Get Data
-        row = chunk_data.iloc[0]
-        vitals_vec = row[["HR", "MAP", "SpO2", "Temp", "RR"]].values
-        
-        # 1. TDA (Shape)
-        shape_score = system["tda"].update(vitals_vec)
-        
-        # 2. PINN (Physics)
-        phys_valid, phys_score, phys_reason = system["pinn"].validate(vitals_vec)
-        
-        # 3. KAN (Risk)
-        risk_score, formula = system["kan"].predict_risk(shape_score, phys_score)
-        
-        # 4. Agent Decision
+# --- RENDER LOOP ---
+def render(snap):
+    """
+    Draws one Snapshot. Nothing here feeds back into the computation.
+    """
+    display_decision = snap.display_decision
+    vitals = snap.vitals
+
+    # Toast once per new real-inference trigger
+    if snap.trigger_seq > st.session_state.last_toast_seq:
+        st.session_state.last_toast_seq = snap.trigger_seq
+        st.toast(f"🧠 Copilot Thinking... ({snap.trigger})")
+
+    # --- UI UPDATE: COPILOT HERO ---
+    # Clear and rebuild the container each frame to prevent stacking
+    with copilot_placeholder.container(border=True):
+        # 1. Status Banner
+        state = display_decision.get('risk_state', 'GREEN')
         
-        # Snapshot string for the agent
-        snapshot_str = f"HR {row['HR']:.0f}, MAP {row['MAP']:.0f}, RR {row['RR']:.0f}"
-        shape_desc = f"Stable (Radius {shape_score:.2f})"
-        if shape_score > 2.0:
-             shape_desc = f"EXPLODING (Radius {shape_score:.2f}). Variance High."
-
-        # Default: Simulation Result
-        decision = system["agent"].evaluate(risk_score, phys_valid, formula, 
-                                          run_real_inference=False, 
-                                          shape_desc=shape_desc,
-                                          vitals_snapshot=snapshot_str)
-        
-        # Triggers
-        triggers = []
-        if run_deep_analysis: triggers.append("Manual")
-        if enable_auto_analysis and risk_score > 0.6: triggers.append("Auto-Risk") # Lower threshold for "Concern"
-        
-        # Background Thread (Real Inference)
-        if triggers and not st.session_state.is_analyzing:
-            if time.time() - st.session_state.get("last_trigger_time", 0) > 8:
-                st.session_state.is_analyzing = True
-                st.session_state.last_trigger_time = time.time()
-                
-                def background_task(chk_agent, r_score, p_valid, form, s_desc, v_snap):
-                    res = chk_agent.evaluate(r_score, p_valid, form, 
-                                           run_real_inference=True, 
-                                           shape_desc=s_desc,
-                                           vitals_snapshot=v_snap)
-                    st.session_state.analysis_result = res
-                    st.session_state.is_analyzing = False
-                    
-                t = threading.Thread(target=background_task, args=(system["agent"], risk_score, phys_valid, formula, shape_desc, snapshot_str))
-                t.start()
-                st.toast(f"🧠 Copilot Thinking... ({triggers[0]})")
-
-        # Hysteresis / Stability Logic for UI
-        curr_time = time.time()
-        if st.session_state.analysis_result and (curr_time - st.session_state.last_trigger_time < 15):
-            display_decision = st.session_state.analysis_result
+        if snap.is_analyzing:
+            st.info("🧠 **MedGemma is analyzing patterns...** (Resolving Ambiguity)")
         else:
-             # Latched Logic
-            if decision['risk_state'] in ["RED", "ORANGE"]:
-                st.session_state.latched_decision = decision
-                st.session_state.last_alert_time = curr_time
-                display_decision = decision
-            elif (curr_time - st.session_state.get("last_alert_time", 0) < 5.0) and st.session_state.latched_decision:
-                 display_decision = st.session_state.latched_decision
+            if state == "RED":
+                st.error(f"🚨 **CRITICAL: {display_decision.get('conflict', 'Risk Detected')}**")
+            elif state == "ORANGE":
+                st.warning(f"⚠️ **CONCERN: {display_decision.get('conflict', 'Instability')}**")
+            elif state == "YELLOW":
+                st.warning(f"⚠️ **SENSOR: {display_decision.get('conflict', 'Artifact')}**")
             else:
-                 display_decision = decision
-            
-        # --- UI UPDATE: COPILOT HERO ---
-        # Clear and rebuild the container each frame to prevent stacking
-        with copilot_placeholder.container(border=True):
-            # 1. Status Banner
-            state = display_decision.get('risk_state', 'GREEN')
-            
-            if st.session_state.is_analyzing:
-                st.info("🧠 **MedGemma is analyzing patterns...** (Resolving Ambiguity)")
-            else:
-                if state == "RED":
-                    st.error(f"🚨 **CRITICAL: {display_decision.get('conflict', 'Risk Detected')}**")
-                elif state == "ORANGE":
-                    st.warning(f"⚠️ **CONCERN: {display_decision.get('conflict', 'Instability')}**")
-                elif state == "YELLOW":
-                    st.warning(f"⚠️ **SENSOR: {display_decision.get('conflict', 'Artifact')}**")
-                else:
-                    st.success("✅ **Patient Stable** (Monitoring for latent shifts)")
-
-            # 2. Structured Rationale Grid
-            c1, c2 = st.columns([2, 1])
-            with c1:
-                st.markdown(f"**Rationale**: {display_decision.get('rationale', 'No active concerns.')}")
-            with c2:
-                st.caption(f"Source: {display_decision.get('inference_mode', 'Sim')}")
-
-            # 3. Actionable Checks (The "Copilot" part)
-            checks = display_decision.get('suggested_checks', 'Continue standard monitoring.')
-            if state != "GREEN":
-                st.info(f"**Suggested Clarifying Checks**: {checks}")
+                st.success("✅ **Patient Stable** (Monitoring for latent shifts)")
+
+        # 2. Structured Rationale Grid
+        c1, c2 = st.columns([2, 1])
+        with c1:
+            st.markdown(f"**Rationale**: {display_decision.get('rationale', 'No active concerns.')}")
+        with c2:
+            st.caption(f"Source: {display_decision.get('inference_mode', 'Sim')} | "
+                       f"Compute: {snap.ticks_per_s:.0f} ticks/s")
+
+        # 3. Actionable Checks (The "Copilot" part)
+        checks = display_decision.get('suggested_checks', 'Continue standard monitoring.')
+        if state != "GREEN":
+            st.info(f"**Suggested Clarifying Checks**: {checks}")
+
+    # --- METRICS UPDATE ---
+    metric_hr.metric("Heart Rate", f"{vitals['HR']:.0f} bpm")
+    metric_map.metric("MAP", f"{vitals['MAP']:.0f} mmHg", delta_color="inverse")
+    metric_spo2.metric("SpO2", f"{vitals['SpO2']:.0f}%")
+    metric_rr.metric("Resp Rate", f"{vitals['RR']:.0f}", help="Tachypnea is often the first sign.")
+    # Risk Metric uses the Copilot's State color now
+    metric_risk.metric("Hemodynamic Risk", f"{snap.risk_score*100:.0f}%", delta=state, delta_color="inverse")
+                       
+    # --- EVIDENCE CHARTS ---
+    hist = snap.history
+    chart_vitals.line_chart(pd.DataFrame({"HR": hist["HR"], "MAP": hist["MAP"]}))
+    
+    # 3D Manifold (Point Cloud)
+    cloud_arr = snap.cloud
+    if len(cloud_arr) > 5:
+        import plotly.graph_objects as go # deferred: first chart only
+        fig = go.Figure(data=[go.Scatter3d(
+            x=cloud_arr[:, 0], y=cloud_arr[:, 1], z=cloud_arr[:, 2],
+            mode='markers',
+            marker=dict(size=4, color=list(range(len(cloud_arr))), colorscale='Viridis', opacity=0.8)
+        )])
+        fig.update_layout(
+            margin=dict(l=0, r=0, b=0, t=0),
+            scene=dict(xaxis=dict(visible=False), yaxis=dict(visible=False), zaxis=dict(visible=False), aspectmode='cube'),
+            height=250,
+        )
+        chart_topology.plotly_chart(fig, use_container_width=True, key=f"topo_{snap.seq}")
 
-        
-        # --- METRICS UPDATE ---
-        metric_hr.metric("Heart Rate", f"{row['HR']:.0f} bpm")
-        metric_map.metric("MAP", f"{row['MAP']:.0f} mmHg", delta_color="inverse")
-        metric_spo2.metric("SpO2", f"{row['SpO2']:.0f}%")
-        metric_rr.metric("Resp Rate", f"{row['RR']:.0f}", help="Tachypnea is often the first sign.")
-        # Risk Metric uses the Copilot's State color now
-        metric_risk.metric("Hemodynamic Risk", f"{risk_score*100:.0f}%", delta=state, delta_color="inverse")
-                           
-        # --- EVIDENCE CHARTS ---
-        hist = st.session_state.history
-        hist["HR"].append(row["HR"])
-        hist["MAP"].append(row["MAP"])
-        hist["Shape"].append(shape_score)
-        hist["Risk"].append(risk_score)
-        hist["RR"].append(row["RR"])
-        if len(hist["HR"]) > 100: 
-            for k in hist: 
-                if len(hist[k]) > 0: hist[k].pop(0)
-            
-        chart_vitals.line_chart(pd.DataFrame({"HR": hist["HR"], "MAP": hist["MAP"]}))
-        
-        # 3D Manifold (Point Cloud)
-        cloud = system["tda"].point_cloud
-        if len(cloud) > 5:
-            cloud_arr = np.array(cloud)
-            fig = go.Figure(data=[go.Scatter3d(
-                x=cloud_arr[:, 0], y=cloud_arr[:, 1], z=cloud_arr[:, 2],
-                mode='markers',
-                marker=dict(size=4, color=list(range(len(cloud))), colorscale='Viridis', opacity=0.8)
-            )])
-            fig.update_layout(
-                margin=dict(l=0, r=0, b=0, t=0),
-                scene=dict(xaxis=dict(visible=False), yaxis=dict(visible=False), zaxis=dict(visible=False), aspectmode='cube'),
-                height=250,
-            )
-            chart_topology.plotly_chart(fig, use_container_width=True, key=f"topo_{chunk_idx}")
-            
-        # Stop check
-        if not st.session_state.running: break
+if st.session_state.running:
+    worker.resume()
+    last_seq = -1
+    
+    # Read the latest snapshot at our own frame rate; skipped frames are fine
+    while st.session_state.running:
+        worker.heartbeat() # Keeps the worker running only while this session renders
+        snap = worker.buffer.read()
+        if snap is not None and snap.seq != last_seq:
+            last_seq = snap.seq
+            render(snap)
+            if snap.done: break
+        time.sleep(FRAME_SECONDS)
 else:
+    worker.pause()
+    snap = worker.buffer.read()
+    if snap is not None:
+        render(snap)
     st.info("Click 'Start Simulation' to enable the Triage Copilot.")
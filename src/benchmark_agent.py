@@ -0,0 +1,198 @@
+import os
+import time
+import argparse
+import contextlib
+import tempfile
+import threading
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+from transformers import GemmaConfig, GemmaForCausalLM, PreTrainedTokenizerFast
+
+from layer_4_agent import RealInferenceEngine, MedGemmaAgent, extract_json
+
+def sample_prompts(n, seed=0):
+    """
+    Real Triage Copilot prompts for `n` different patients.
+    """
+    agent = MedGemmaAgent()
+    gen = torch.Generator().manual_seed(seed)
+    prompts = []
+    for i in range(n):
+        hr, map_bp, rr = (torch.rand(3, generator=gen) * torch.tensor([60, 50, 15]) + torch.tensor([70, 55, 14])).tolist()
+        shape = 1.0 + 3.0 * torch.rand(1, generator=gen).item()
+        prompts.append(agent.construct_prompt(0.5 + 0.4 * torch.rand(1, generator=gen).item(), True, "",
+                                              shape_desc=f"Stable (Radius {shape:.2f})",
+                                              vitals_snapshot=f"HR {hr:.0f}, MAP {map_bp:.0f}, RR {rr:.0f}"))
+    return prompts
+
+def make_tiny_model(path, vocab_size=512, hidden_size=64, n_layers=2, seed=0):
+    """
+    A randomly initialised Gemma-architecture model (default 2 layers, 64 hidden) plus a
+    BPE tokenizer trained on the agent's own prompts, saved to `path` so that
+    RealInferenceEngine(model_id=path) loads it like any checkpoint. CPU-sized,
+    no download: generation cost is real, the text is noise.
+    """
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["<pad>", "<eos>", "<bos>", "<unk>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    corpus = sample_prompts(64) + ['{"risk_state": "Red", "conflict": "None", "rationale": "", "suggested_checks": ""}']
+    tokenizer.train_from_iterator(corpus, trainer)
+    fast = PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="<eos>",
+                                   bos_token="<bos>", unk_token="<unk>")
+    fast.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = GemmaConfig(vocab_size=len(fast), hidden_size=hidden_size, intermediate_size=2 * hidden_size,
+                         num_hidden_layers=n_layers, num_attention_heads=4, num_key_value_heads=1,
+                         head_dim=hidden_size // 4,
+                         pad_token_id=fast.pad_token_id, eos_token_id=fast.eos_token_id,
+                         bos_token_id=fast.bos_token_id)
+    GemmaForCausalLM(config).save_pretrained(path)
+    return path
+
+# A well-formed answer followed by the chatter instruction-tuned models tend to append
+JSON_ANSWER = ('{"risk_state": "Orange", "conflict": "Rising Volatility", "rationale": "Topology radius is drifting '
+               'while vitals stay normal.", "suggested_checks": "Lactate, CRT, urine output."}')
+CHATTER = ("\n\nExplanation: the manifold radius is increasing, which suggests early decoherence. "
+           "Physics check is valid, so a sensor artifact is unlikely. Continue to monitor closely. ") * 6
+
+def teach_json(path, steps=150, lr=3e-3, seed=0):
+    """
+    Briefly train the tiny model to answer every prompt with JSON_ANSWER + CHATTER
+    (completion tokens only), so generation behaves like a chatty instruction model:
+    a JSON object first, then free text until max_new_tokens.
+    """
+    tokenizer = PreTrainedTokenizerFast.from_pretrained(path)
+    model = GemmaForCausalLM.from_pretrained(path)
+    prompts = sample_prompts(16, seed=seed + 2)
+    completion = tokenizer(JSON_ANSWER + CHATTER, add_special_tokens=False).input_ids
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    model.train()
+    for step in range(steps):
+        prompt = tokenizer(prompts[step % len(prompts)], add_special_tokens=False).input_ids
+        input_ids = torch.tensor([prompt + completion])
+        labels = torch.tensor([[-100] * len(prompt) + completion])
+        loss = model(input_ids=input_ids, labels=labels).loss
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    model.eval()
+    model.save_pretrained(path)
+    return loss.item()
+
+def load_engine(path, **kwargs):
+    engine = RealInferenceEngine(model_id=path, **kwargs)
+    if not engine.load_model():
+        raise RuntimeError(engine.load_error)
+    return engine
+
+def bench_batching(model_path, n_patients=8, max_new_tokens=64, window=0.05):
+    prompts = sample_prompts(n_patients, seed=1)
+
+    def run(engine, lock):
+        # All beds cross the threshold together: one caller thread per bed
+        latencies = [0.0] * len(prompts)
+        def call(i):
+            start = time.perf_counter()
+            with lock:
+                engine.generate(prompts[i])
+            latencies[i] = time.perf_counter() - start
+        engine.generated_tokens = 0
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(prompts))]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+        return latencies, engine.generated_tokens / wall
+
+    # Serial: callers take turns on one engine (one generation in flight, as in the app)
+    serial = load_engine(model_path, max_new_tokens=max_new_tokens)
+    serial.generate(prompts[0]) # warm-up
+    batched = load_engine(model_path, max_new_tokens=max_new_tokens, batch_window=window, max_batch=n_patients)
+    batched.generate(prompts[0])
+
+    for label, engine, lock in (("serial", serial, threading.Lock()),
+                                (f"micro-batched ({window * 1e3:.0f} ms window)", batched, contextlib.nullcontext())):
+        latencies, tokens_per_s = run(engine, lock)
+        print(f"[{label}] {n_patients} simultaneous requests: mean latency {sum(latencies) / len(latencies):.2f} s, "
+              f"max {max(latencies):.2f} s | {tokens_per_s:.0f} generated tokens/s")
+
+def bench_stopping(model_path, n_calls=5, max_new_tokens=256):
+    prompts = sample_prompts(n_calls, seed=3)
+    for label, json_stop in (("full max_new_tokens", False), ("JSON stop", True)):
+        engine = load_engine(model_path, max_new_tokens=max_new_tokens, json_stop=json_stop)
+        engine.generate(prompts[0]) # warm-up
+        engine.generated_tokens = 0
+        parsed = 0
+        start = time.perf_counter()
+        for prompt in prompts:
+            parsed += extract_json(engine.generate(prompt)) is not None
+        elapsed = (time.perf_counter() - start) / n_calls
+        print(f"[{label}] {engine.generated_tokens / n_calls:.0f} new tokens/call, {elapsed:.2f} s/call, "
+              f"JSON parsed in {parsed}/{n_calls}")
+
+def bench_prefix(model_path, n_calls=20, max_new_tokens=256):
+    prompts = sample_prompts(n_calls, seed=4)
+    prefix = MedGemmaAgent.SYSTEM_PROMPT + "\n"
+    engines = {
+        "full prefill": load_engine(model_path, max_new_tokens=max_new_tokens),
+        "cached system prefix": load_engine(model_path, max_new_tokens=max_new_tokens, prompt_prefix=prefix),
+    }
+    tokenizer = engines["full prefill"].tokenizer
+    n_prompt = len(tokenizer(prompts[0]).input_ids)
+    n_prefix = len(tokenizer(prefix).input_ids) - 1
+    print(f"Prompt {n_prompt} tokens, reusable prefix {n_prefix} tokens")
+
+    texts = {}
+    for label, engine in engines.items():
+        engine.generate(prompts[0]) # warm-up (builds the prefix cache)
+
+        # Prefill only: a single new token per request
+        engine.max_new_tokens = 1
+        start = time.perf_counter()
+        for prompt in prompts:
+            engine.generate(prompt)
+        prefill_ms = (time.perf_counter() - start) / n_calls * 1e3
+
+        # Whole request, same sampling seed per prompt for both engines
+        engine.max_new_tokens = max_new_tokens
+        texts[label] = []
+        start = time.perf_counter()
+        for i, prompt in enumerate(prompts):
+            torch.manual_seed(i)
+            texts[label].append(engine.generate(prompt))
+        call_ms = (time.perf_counter() - start) / n_calls * 1e3
+        print(f"[{label}] prefill + 1 token: {prefill_ms:.1f} ms/request | full request: {call_ms:.1f} ms "
+              f"(prefix reused {engine.prefix_reused}x)")
+    same = sum(a == b for a, b in zip(*texts.values()))
+    print(f"Identical outputs with and without the cached prefix: {same}/{n_calls}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Layer 4 (agent) inference benchmarks on a tiny random model")
+    parser.add_argument("bench", choices=["batching", "stopping", "prefix"])
+    parser.add_argument("--model", default=None, help="Model path (default: build a tiny random model)")
+    parser.add_argument("--patients", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=None)
+    parser.add_argument("--hidden", type=int, default=64, help="Hidden size of the random model")
+    parser.add_argument("--layers", type=int, default=2, help="Layers of the random model")
+    args = parser.parse_args()
+
+    torch.set_num_threads(os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model or make_tiny_model(os.path.join(tmp, "tiny-gemma"), hidden_size=args.hidden,
+                                                   n_layers=args.layers)
+        if args.bench == "batching":
+            bench_batching(model_path, n_patients=args.patients, max_new_tokens=args.max_new_tokens or 64)
+        elif args.bench == "stopping":
+            if args.model is None:
+                print(f"Taught the tiny model JSON answers (final loss {teach_json(model_path):.3f})")
+            bench_stopping(model_path, max_new_tokens=args.max_new_tokens or 256)
+        elif args.bench == "prefix":
+            if args.model is None:
+                teach_json(model_path)
+            bench_prefix(model_path, max_new_tokens=args.max_new_tokens or 256)
@@ -0,0 +1,396 @@
+import os
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from gtda.homology import VietorisRipsPersistence
+from sklearn.random_projection import SparseRandomProjection
+from layer_1_tda import (TopologicalSensor, WardTopologicalSensor, RingBuffer,
+                         RollingDistanceMatrix, JLProjection, BaselineStore)
+
+VITALS = ["HR", "MAP", "SpO2", "Temp", "RR"]
+
+def load_ward(csv_path, n_beds):
+    """
+    Builds a fake ward from one recording: each bed replays the CSV from a
+    different offset, so the beds are at different phases of the scenario.
+    Returns an array of shape (n_ticks, n_beds, n_vitals).
+    """
+    vitals = pd.read_csv(csv_path)[VITALS].values
+    offsets = np.linspace(0, len(vitals), n_beds, endpoint=False).astype(int)
+    idx = (np.arange(len(vitals))[:, None] + offsets[None, :]) % len(vitals)
+    return vitals[idx]
+
+def bench_ward(csv_path, n_beds=16, n_ticks=300, n_jobs=None):
+    """
+    Ticks/sec of one batched WardTopologicalSensor vs N separate TopologicalSensors.
+    Both are warmed up past calibration first so we only time steady-state TDA.
+    """
+    ward_data = load_ward(csv_path, n_beds)
+    warmup = 60
+
+    # A. N separate sensors
+    sensors = [TopologicalSensor() for _ in range(n_beds)]
+    for t in range(warmup):
+        for b in range(n_beds):
+            sensors[b].update(ward_data[t, b])
+    start = time.perf_counter()
+    for t in range(warmup, warmup + n_ticks):
+        single_scores = [sensors[b].update(ward_data[t, b]) for b in range(n_beds)]
+    single_tps = n_ticks / (time.perf_counter() - start)
+
+    # B. One ward sensor
+    ward = WardTopologicalSensor(n_beds, n_jobs=n_jobs)
+    for t in range(warmup):
+        ward.update(ward_data[t])
+    start = time.perf_counter()
+    for t in range(warmup, warmup + n_ticks):
+        ward_scores = ward.update(ward_data[t])
+    ward_tps = n_ticks / (time.perf_counter() - start)
+
+    max_diff = np.max(np.abs(np.array(single_scores) - ward_scores))
+    print(f"[ward] beds={n_beds} n_jobs={n_jobs}")
+    print(f"  {n_beds} x TopologicalSensor : {single_tps:8.1f} ward ticks/s")
+    print(f"  WardTopologicalSensor   : {ward_tps:8.1f} ward ticks/s ({ward_tps / single_tps:.2f}x)")
+    print(f"  max |score diff| on last tick: {max_diff:.2e}")
+
+class ListBufferState:
+    """
+    The pre-ring-buffer Layer 1 state (Python lists + pop(0) + np.array rebuilds),
+    kept here only as the "before" side of the buffering microbenchmark.
+    """
+    def __init__(self, window_size=20, cloud_size=50):
+        self.window_size = window_size
+        self.cloud_size = cloud_size
+        self.raw_buffer = []
+        self.point_cloud = []
+
+    def step(self, row, point):
+        self.raw_buffer.append(row.flatten().tolist())
+        if len(self.raw_buffer) > self.window_size:
+            self.raw_buffer.pop(0)
+        embedded = np.array(self.raw_buffer).flatten().reshape(1, -1)
+        self.point_cloud.append(point)
+        if len(self.point_cloud) > self.cloud_size:
+            self.point_cloud.pop(0)
+        return embedded, np.array(self.point_cloud)[None, :, :]
+
+class RingBufferState:
+    """
+    The same state path on the preallocated mirrored rings used by TopologicalSensor.
+    """
+    def __init__(self, window_size=20, cloud_size=50, n_vitals=5, projection_dim=10):
+        self.raw_ring = RingBuffer(window_size, n_vitals)
+        self.cloud_ring = RingBuffer(cloud_size, projection_dim)
+
+    def step(self, row, point):
+        self.raw_ring.push(row)
+        embedded = self.raw_ring.window().reshape(1, -1)
+        self.cloud_ring.push(point)
+        return embedded, self.cloud_ring.window()[None, :, :]
+
+def bench_buffers(csv_path, n_ticks=5000):
+    """
+    Per-update latency and transient allocations of the Layer 1 buffering path
+    (raw window -> 100d embedding -> 50x10 cloud), before vs after the ring buffers.
+    Projection and TDA are excluded: they are identical on both sides.
+    """
+    vitals = pd.read_csv(csv_path)[VITALS].values[:n_ticks]
+    points = np.random.default_rng(0).normal(size=(len(vitals), 10))
+
+    for label, state in [("list + pop(0)", ListBufferState()), ("ring buffer", RingBufferState())]:
+        # Warm up so both are at steady-state size
+        for t in range(100):
+            state.step(vitals[t], points[t])
+
+        start = time.perf_counter()
+        for t in range(len(vitals)):
+            state.step(vitals[t], points[t])
+        latency_us = (time.perf_counter() - start) / len(vitals) * 1e6
+
+        # Peak bytes allocated inside a single update (numpy reports to tracemalloc)
+        tracemalloc.start()
+        peaks = []
+        for t in range(500):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            state.step(vitals[t], points[t])
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+        print(f"[buffers] {label:14s}: {latency_us:6.2f} us/update, "
+              f"{np.mean(peaks):7.0f} B transient alloc/update")
+
+def bench_distances(cloud_sizes=(50, 100, 200), n_ticks=300, dim=10):
+    """
+    Per-tick cost of the cloud metric: full O(n^2 * d) recompute vs the rolling
+    O(n * d) row update, and the resulting Vietoris-Rips call on each.
+    """
+    rng = np.random.default_rng(0)
+    vr_points = VietorisRipsPersistence(metric="euclidean", homology_dimensions=[0, 1])
+    vr_dist = VietorisRipsPersistence(metric="precomputed", homology_dimensions=[0, 1])
+
+    for n in cloud_sizes:
+        points = np.cumsum(rng.normal(size=(n + n_ticks, dim)), axis=0) * 0.1
+        ring = RingBuffer(n, dim)
+        rolling = RollingDistanceMatrix(ring)
+        for p in points[:n]:
+            rolling.push(p)
+
+        # Metric only
+        start = time.perf_counter()
+        for t in range(n, n + n_ticks):
+            cloud = points[t - n + 1:t + 1]
+            diff = cloud[:, None, :] - cloud[None, :, :]
+            np.sqrt((diff ** 2).sum(-1))
+        full_us = (time.perf_counter() - start) / n_ticks * 1e6
+
+        start = time.perf_counter()
+        for t in range(n, n + n_ticks):
+            rolling.push(points[t])
+        roll_us = (time.perf_counter() - start) / n_ticks * 1e6
+
+        # End-to-end persistence (gtda computes the metric itself vs precomputed)
+        k = min(n_ticks, 30)
+        start = time.perf_counter()
+        for t in range(k):
+            d_points = vr_points.fit_transform(ring.window()[None])
+        vr_full_ms = (time.perf_counter() - start) / k * 1e3
+        start = time.perf_counter()
+        for t in range(k):
+            d_dist = vr_dist.fit_transform(rolling.window()[None])
+        vr_roll_ms = (time.perf_counter() - start) / k * 1e3
+
+        same = np.allclose(np.sort(d_points[0], axis=0), np.sort(d_dist[0], axis=0))
+        print(f"[distances] n={n:4d}: metric {full_us:8.1f} -> {roll_us:6.1f} us/tick | "
+              f"VR {vr_full_ms:7.2f} -> {vr_roll_ms:7.2f} ms/tick | same diagram: {same}")
+
+def bench_gating(csv_path, thresholds=(0.02, 0.05, 0.1, 0.25), max_holds=(10, 30)):
+    """
+    Latency vs fidelity of change-gated TDA on a whole recording.
+    Error is measured against the ungated sensor (recompute every tick).
+    """
+    vitals = pd.read_csv(csv_path)[VITALS].values
+
+    def replay(sensor):
+        start = time.perf_counter()
+        scores = np.array([sensor.update(row) for row in vitals])
+        return scores, (time.perf_counter() - start) / len(vitals) * 1e3
+
+    exact, exact_ms = replay(TopologicalSensor())
+    print(f"[gating] ungated: {exact_ms:.2f} ms/tick")
+    for max_hold in max_holds:
+        for threshold in thresholds:
+            sensor = TopologicalSensor(gate_threshold=threshold, max_hold=max_hold)
+            gated, gated_ms = replay(sensor)
+            err = np.abs(gated - exact)
+            skipped = sensor.n_skipped / max(sensor.n_skipped + sensor.n_recomputed, 1)
+            print(f"[gating] thr={threshold:<5} hold={max_hold:3d}: {gated_ms:5.2f} ms/tick, "
+                  f"skipped {skipped:6.1%}, |err| mean={err.mean():.3f} p99={np.percentile(err, 99):.3f} max={err.max():.3f}")
+
+def bench_projection(csv_path, window_size=20, projection_dim=10):
+    """
+    Projecting every delay-embedded window of a recording:
+    per-sample sklearn transform (old) vs per-sample matmul vs one batched matmul.
+    """
+    vitals = pd.read_csv(csv_path)[VITALS].values
+    n_windows = len(vitals) - window_size + 1
+    embedded = np.stack([vitals[i:i + window_size].reshape(-1) for i in range(n_windows)])
+
+    srp = SparseRandomProjection(n_components=projection_dim, random_state=42)
+    srp.fit(embedded[:1])
+    start = time.perf_counter()
+    ref = np.vstack([srp.transform(e.reshape(1, -1)) for e in embedded])
+    sklearn_ms = (time.perf_counter() - start) * 1e3
+
+    projection = JLProjection.build(embedded.shape[1], projection_dim)
+    out = np.zeros((1, projection_dim))
+    start = time.perf_counter()
+    for e in embedded:
+        projection.project(e.reshape(1, -1), out=out)
+    matmul_ms = (time.perf_counter() - start) * 1e3
+
+    projection.project_windows(vitals[:100], window_size) # warm up
+    start = time.perf_counter()
+    batch = projection.project_windows(vitals, window_size)
+    batch_ms = (time.perf_counter() - start) * 1e3
+
+    print(f"[projection] {n_windows} windows:")
+    print(f"  sklearn transform per sample : {sklearn_ms:8.1f} ms")
+    print(f"  JLProjection per sample      : {matmul_ms:8.1f} ms")
+    print(f"  JLProjection.project_windows : {batch_ms:8.1f} ms (one matmul)")
+    print(f"  max |batch - sklearn|        : {np.abs(batch - ref).max():.2e}")
+
+def bench_recording(csv_path, n_jobs=None):
+    """
+    Shape-score series for a whole recording: streaming replay through `update`
+    vs the offline `score_recording` bulk path.
+    """
+    vitals = pd.read_csv(csv_path)[VITALS]
+
+    start = time.perf_counter()
+    sensor = TopologicalSensor()
+    streamed = np.array([sensor.update(row) for row in vitals.values])
+    stream_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bulk = TopologicalSensor().score_recording(vitals, n_jobs=n_jobs)
+    bulk_s = time.perf_counter() - start
+
+    print(f"[recording] {len(vitals)} rows, n_jobs={n_jobs}")
+    print(f"  streaming replay : {stream_s:6.2f} s")
+    print(f"  score_recording  : {bulk_s:6.2f} s ({bulk_s / stream_s:.0%} of streaming)")
+    print(f"  max |bulk - streaming| = {np.abs(bulk - streamed).max():.2e}")
+
+def bench_witness(csv_path, cloud_sizes=(50, 200), landmark_counts=(20, 80), nus=(0, 2), stride=40):
+    """
+    Is the witness complex (maxmin landmarks) a usable stand-in for exact
+    Vietoris-Rips? Every `stride`-th cloud of the whole recording is scored both
+    ways. The witness amplitude has its own scale, so it is normalised by the
+    exact/witness ratio over the first fifth of the clouds (the calibration phase)
+    before comparing: correlation, and mean / max gap relative to the exact score.
+    """
+    from gtda.diagrams import Amplitude
+    from layer_1_tda import maxmin_landmarks, witness_filtration
+    vitals = pd.read_csv(csv_path)[VITALS].values
+    vr = VietorisRipsPersistence(metric="precomputed", homology_dimensions=[0, 1])
+    amplitude = Amplitude(metric="wasserstein")
+
+    def timed_scores(matrices):
+        start = time.perf_counter()
+        scores = np.array([amplitude.fit_transform(vr.fit_transform(m[None]))[0][1] for m in matrices])
+        return scores, (time.perf_counter() - start) / len(matrices) * 1e3
+
+    for cloud_size in cloud_sizes:
+        sensor = TopologicalSensor(cloud_size=cloud_size)
+        clouds = []
+        for i, row in enumerate(vitals):
+            sensor.update(row)
+            if sensor.cloud_ring.count == cloud_size and i % stride == 0:
+                clouds.append(sensor.cloud_dist.window().copy())
+        exact, vr_ms = timed_scores(clouds)
+        n_calib = max(len(clouds) // 5, 1)
+        print(f"[witness] cloud={cloud_size}: {len(clouds)} clouds, exact VR {vr_ms:.2f} ms/tick, "
+              f"score mean {exact.mean():.2f} std {exact.std():.2f}")
+
+        for n_landmarks in landmark_counts:
+            for nu in nus:
+                start = time.perf_counter()
+                filtrations = [witness_filtration(d, maxmin_landmarks(d, n_landmarks), nu=nu) for d in clouds]
+                build_ms = (time.perf_counter() - start) / len(clouds) * 1e3
+                approx, witness_ms = timed_scores(filtrations)
+                scale = exact[:n_calib].mean() / max(approx[:n_calib].mean(), 1e-12)
+                rel_gap = np.abs(approx * scale - exact) / exact
+                corr = np.corrcoef(approx, exact)[0, 1]
+                print(f"  landmarks={n_landmarks:3d} nu={nu}: {build_ms + witness_ms:5.2f} ms/tick, "
+                      f"corr={corr:.2f}, scale x{scale:.1f}, normalised |gap| mean={rel_gap.mean():.0%} "
+                      f"max={rel_gap.max():.0%}")
+
+    # The opt-in sensor backend, audited against exact VR on every 10th recompute (also in the pyramid)
+    sensor = TopologicalSensor(backend="witness", n_landmarks=20, witness_audit_every=10, pyramid=(10,))
+    for row in vitals:
+        sensor.update(row)
+    for label, audited in (("sensor", sensor), ("pyramid x10", sensor.pyramid.sensors[0])):
+        drift = audited.backend_drift()
+        print(f"[witness] backend_drift ({label}, cloud=50, 20 landmarks): {drift['n_audits']} audits, "
+              f"|gap| mean={drift['mean_abs']:.2f} max={drift['max_abs']:.2f}, mean relative {drift['mean_rel']:.0%}")
+
+def bench_pyramid(csv_path, factors=(10, 60)):
+    """
+    Per-tick cost of adding the multi-resolution pyramid, and what each level sees.
+    """
+    vitals = pd.read_csv(csv_path)[VITALS].values
+    for pyramid in (None, factors):
+        sensor = TopologicalSensor(pyramid=pyramid)
+        start = time.perf_counter()
+        for row in vitals:
+            sensor.update(row)
+        ms = (time.perf_counter() - start) / len(vitals) * 1e3
+        print(f"[pyramid] levels={pyramid}: {ms:.2f} ms/tick")
+
+    for factor in factors:
+        minutes = sensor.pyramid.horizon_seconds(factor) / 60
+        print(f"  level {factor:3d}s: horizon {minutes:6.1f} min, final score {sensor.horizon_scores()[factor]:.3f}")
+
+def bench_timing(csv_path, n_ticks=2000, pyramid=(10, 60)):
+    """
+    Overhead of the per-stage instrumentation, and the stage breakdown it reports
+    (with and without the multi-resolution pyramid).
+    """
+    vitals = pd.read_csv(csv_path)[VITALS].values[:n_ticks]
+    for timing in (False, True):
+        sensor = TopologicalSensor(timing=timing)
+        start = time.perf_counter()
+        for row in vitals:
+            sensor.update(row)
+        ms = (time.perf_counter() - start) / len(vitals) * 1e3
+        print(f"[timing] instrumentation {'on ' if timing else 'off'}: {ms:.3f} ms/tick")
+
+    pyramid_sensor = TopologicalSensor(timing=True, pyramid=pyramid)
+    for row in vitals:
+        pyramid_sensor.update(row)
+    for label, timed in (("", sensor), (f" (pyramid={pyramid})", pyramid_sensor)):
+        print(f"[timing] stage breakdown{label}:")
+        for stage, stats in timed.timing_report().items():
+            print(f"  {stage:12s} n={stats['count']:5d}  p50={stats['p50_ms']:7.3f}  "
+                  f"p95={stats['p95_ms']:7.3f}  p99={stats['p99_ms']:7.3f} ms")
+
+def bench_warmstart(csv_path, root="data/baselines", split=1000):
+    """
+    Coverage lost after a monitor restart: ticks until the first valid score,
+    cold vs resumed from a BaselineStore.
+    """
+    vitals = pd.read_csv(csv_path)[VITALS].values
+    store = BaselineStore(root)
+
+    before = TopologicalSensor()
+    for row in vitals[:split]:
+        before.update(row)
+    store.save("bench_patient", before)
+
+    for label, sensor in [("cold", TopologicalSensor()),
+                          ("warm", TopologicalSensor(baseline_store=store, patient_id="bench_patient"))]:
+        first_valid = None
+        for t, row in enumerate(vitals[split:split + 200]):
+            score = sensor.update(row)
+            if first_valid is None and score > 0:
+                first_valid = t + 1
+                first_score, first_norm = score, sensor.normalized_score
+        print(f"[warmstart] {label}: first valid score on tick {first_valid} "
+              f"(score={first_score:.3f}, normalized={first_norm})")
+
+    # The uninterrupted sensor sees the same next tick the warm one did
+    print(f"  uninterrupted sensor on that tick: {before.update(vitals[split]):.3f}")
+    os.remove(store.path("bench_patient"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Layer 1 (TDA) microbenchmarks")
+    parser.add_argument("bench", choices=["ward", "buffers", "distances", "gating", "projection", "recording", "witness", "pyramid", "timing", "warmstart"])
+    parser.add_argument("--csv", default="data/mock_vitals_v2.csv")
+    parser.add_argument("--beds", type=int, default=16)
+    parser.add_argument("--ticks", type=int, default=300)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.bench == "ward":
+        bench_ward(args.csv, n_beds=args.beds, n_ticks=args.ticks, n_jobs=args.n_jobs)
+    elif args.bench == "buffers":
+        bench_buffers(args.csv)
+    elif args.bench == "distances":
+        bench_distances()
+    elif args.bench == "gating":
+        bench_gating(args.csv)
+    elif args.bench == "projection":
+        bench_projection(args.csv)
+    elif args.bench == "recording":
+        bench_recording(args.csv, n_jobs=args.n_jobs)
+    elif args.bench == "witness":
+        bench_witness(args.csv)
+    elif args.bench == "pyramid":
+        bench_pyramid(args.csv)
+    elif args.bench == "timing":
+        bench_timing(args.csv)
+    elif args.bench == "warmstart":
+        bench_warmstart(args.csv)
@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+
+# Channels stored per (HR, MAP) grid node
+VALID, PHYSICS = 0, 1
+
+class FusedRiskSurface:
+    def __init__(self, table, meta):
+        """
+        Layers 2+3 compiled into lookups: (HR, MAP, Shape) -> (validity, physics, risk).
+
+        The KAN is additive (Risk = phi_shape(Shape) + phi_phys(Physics)), so Shape
+        never needs to be gridded: `table` is an (n_hr, n_map, 2) float32 grid of the
+        PINN's (validity, physics) over (HR, MAP), normally memory-mapped from disk,
+        and both KAN edges are 1-D lookup tables stored in the JSON sidecar. A tick
+        is one bilinear lookup plus two LUT reads, in pure float math. Only numpy
+        is needed at load time (no scipy, no PINN/KAN objects).
+
+        Nothing is blended across the valid/invalid discontinuity: in a cell whose
+        4 corners disagree, validity and physics both come from the nearest node
+        (physics 0.0 only when that node is invalid), so a valid reading always
+        carries a valid reading's physics score.
+        HR / MAP outside the grid are invalid (the PINN's hard filter).
+        The surface is compiled for a fixed stroke volume, so per-patient SV
+        tracking (HemodynamicPINN.track_batch) is not represented.
+        """
+        self.table = table
+        self.meta = meta
+        self.lo = np.array([meta["hr"][0], meta["map"][0]], dtype=float)
+        self.hi = np.array([meta["hr"][1], meta["map"][1]], dtype=float)
+        self.dims = np.array(table.shape[:2])
+        self.step = (self.hi - self.lo) / (self.dims - 1)
+
+        # KAN edges: uniform LUTs on [0, x_max], linear interpolation between samples
+        self.shape_lut = np.array(meta["shape_lut"])
+        self.physics_lut = np.array(meta["physics_lut"])
+        self.shape_max = float(meta["shape_max"])
+        self._shape_lut = meta["shape_lut"]
+        self._physics_lut = meta["physics_lut"]
+        self._shape_scale = (len(self._shape_lut) - 1) / self.shape_max
+        self._physics_scale = float(len(self._physics_lut) - 1)
+
+        # Scalar path: plain-float constants and a flat float32 view of the mapping
+        self._lo_hr, self._lo_map = self.lo.tolist()
+        self._hi_hr, self._hi_map = self.hi.tolist()
+        self._inv_hr, self._inv_map = (1.0 / self.step).tolist()
+        self._last_hr, self._last_map = (self.dims - 2).tolist() # last cell index
+        self._stride_hr = int(self.dims[1]) * 2
+        self._flat = memoryview(np.asarray(table).reshape(-1)).cast("B").cast("f")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map `<path>.npy` and read the grid axes and KAN LUTs from `<path>.json`.
+        """
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        return cls(np.load(path + ".npy", mmap_mode="r"), meta)
+
+    def evaluate(self, hr, map_val, shape_score):
+        """
+        One tick: returns (is_valid, physics_score, risk) as Python values.
+        """
+        hr = float(hr)
+        map_val = float(map_val)
+        if not (self._lo_hr <= hr <= self._hi_hr and self._lo_map <= map_val <= self._hi_map):
+            return False, 0.0, self._risk(shape_score, 0.0)
+
+        # 1. Cell + fraction per axis
+        px = (hr - self._lo_hr) * self._inv_hr
+        i = int(px)
+        if i > self._last_hr:
+            i = self._last_hr
+        fx = px - i
+        py = (map_val - self._lo_map) * self._inv_map
+        j = int(py)
+        if j > self._last_map:
+            j = self._last_map
+        fy = py - j
+
+        # 2. Corners: physics blended inside all-valid cells; in a mixed cell the
+        # nearest node supplies both validity and physics (0.0 where it is invalid)
+        flat = self._flat
+        n00 = (i * self._stride_hr) + 2 * j
+        n10 = n00 + self._stride_hr
+        if flat[n00] and flat[n00 + 2] and flat[n10] and flat[n10 + 2]:
+            physics = ((1.0 - fx) * ((1.0 - fy) * flat[n00 + 1] + fy * flat[n00 + 3])
+                       + fx * ((1.0 - fy) * flat[n10 + 1] + fy * flat[n10 + 3]))
+            return True, physics, self._risk(shape_score, physics)
+        nearest = (n00 if fx < 0.5 else n10) + (0 if fy < 0.5 else 2)
+        physics = float(flat[nearest + 1])
+        return flat[nearest] > 0.5, physics, self._risk(shape_score, physics)
+
+    def _risk(self, shape_score, physics):
+        # Additive KAN through both edge LUTs (same clamping / NaN behaviour as SplineEdge)
+        x = float(shape_score)
+        if x != x:
+            return x
+        lut = self._shape_lut
+        if x <= 0.0:
+            risk = lut[0]
+        elif x >= self.shape_max:
+            risk = lut[-1]
+        else:
+            pos = x * self._shape_scale
+            k = int(pos)
+            risk = lut[k] + (lut[k + 1] - lut[k]) * (pos - k)
+        lut = self._physics_lut
+        if physics <= 0.0:
+            risk += lut[0]
+        elif physics >= 1.0:
+            risk += lut[-1]
+        else:
+            pos = physics * self._physics_scale
+            k = int(pos)
+            risk += lut[k] + (lut[k + 1] - lut[k]) * (pos - k)
+        return min(max(risk, 0.0), 1.0)
+
+    def _corners(self, hr, map_val):
+        # Cell indices and fractions for arrays of (HR, MAP), clamped to the grid
+        pos = (np.clip(np.column_stack([hr, map_val]), self.lo, self.hi) - self.lo) / self.step
+        idx = np.minimum(pos.astype(int), self.dims - 2)
+        return idx, pos - idx
+
+    def evaluate_batch(self, hr, map_val, shape_scores):
+        """
+        Vectorized lookup: returns (valid, physics, risk) arrays.
+        """
+        hr = np.asarray(hr, dtype=float)
+        map_val = np.asarray(map_val, dtype=float)
+        inside = (hr >= self.lo[0]) & (hr <= self.hi[0]) & (map_val >= self.lo[1]) & (map_val <= self.hi[1])
+        idx, frac = self._corners(hr, map_val)
+
+        table = self.table
+        physics = np.zeros(len(hr))
+        all_valid = np.ones(len(hr), dtype=bool)
+        for dx in (0, 1):
+            wx = frac[:, 0] if dx else 1.0 - frac[:, 0]
+            for dy in (0, 1):
+                wy = frac[:, 1] if dy else 1.0 - frac[:, 1]
+                corner = table[idx[:, 0] + dx, idx[:, 1] + dy]
+                all_valid &= corner[:, VALID] > 0.5
+                physics += wx * wy * corner[:, PHYSICS]
+        nearest = table[idx[:, 0] + (frac[:, 0] >= 0.5), idx[:, 1] + (frac[:, 1] >= 0.5)]
+
+        valid = (all_valid | (nearest[:, VALID] > 0.5)) & inside
+        physics = np.where(all_valid, physics, nearest[:, PHYSICS])
+        physics = np.where(inside, physics, 0.0)
+        shape_axis = np.linspace(0.0, self.shape_max, len(self.shape_lut))
+        physics_axis = np.linspace(0.0, 1.0, len(self.physics_lut))
+        risk = np.interp(shape_scores, shape_axis, self.shape_lut) + np.interp(physics, physics_axis, self.physics_lut)
+        return valid, physics, np.clip(risk, 0.0, 1.0)
+
+def exact_path(pinn, kan, hr, map_val, shape_scores):
+    """
+    The uncompiled Layers 2+3 on arrays: PINN.validate_batch -> KAN.predict_risk_batch.
+    """
+    valid, physics, codes, svr, co = pinn.validate_batch(np.column_stack([hr, map_val]))
+    return valid, physics, kan.predict_risk_batch(shape_scores, physics)
+
+def compile_risk_surface(path, pinn=None, kan=None, hr_range=(10.0, 300.0), map_range=(10.0, 300.0),
+                         resolution=(291, 291)):
+    """
+    Sample the PINN's (HR, MAP) -> (validity, physics) onto a 2-D grid and write
+    it as `<path>.npy` (float32) + `<path>.json` (axes and both KAN edge LUTs).
+    The HR / MAP ranges default to the PINN's hard-filter limits.
+    """
+    # Heavy layers are only needed to compile, never to load
+    from layer_2_pinn import HemodynamicPINN
+    from layer_3_kan import PhysicsInformedKAN
+    pinn = pinn or HemodynamicPINN()
+    kan = kan or PhysicsInformedKAN()
+
+    axes = [np.linspace(lo, hi, n) for (lo, hi), n in zip((hr_range, map_range), resolution)]
+    hr, map_val = (a.reshape(-1) for a in np.meshgrid(*axes, indexing="ij"))
+    valid, physics, codes, svr, co = pinn.validate_batch(np.column_stack([hr, map_val]))
+    table = np.stack([valid, physics], axis=-1).astype(np.float32).reshape(*resolution, 2)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.save(path + ".npy", table)
+    with open(path + ".json", "w") as f:
+        json.dump({"hr": list(hr_range), "map": list(map_range), "channels": ["valid", "physics"],
+                   "sv": pinn.estimated_sv, "shape_max": kan.shape_spline.x_max,
+                   "shape_lut": kan.shape_spline._lut_list, "physics_lut": kan.physics_spline._lut_list}, f)
+    return FusedRiskSurface.load(path)
+
+def surface_error(surface, pinn=None, kan=None, n_samples=200000, seed=0):
+    """
+    Max error of the compiled surface vs the exact path on random queries.
+    The exact mapping is discontinuous where validity flips (physics drops to 0),
+    so errors are also reported over "smooth" cells, whose 4 nodes agree on validity.
+    """
+    from layer_2_pinn import HemodynamicPINN
+    from layer_3_kan import PhysicsInformedKAN
+    pinn = pinn or HemodynamicPINN()
+    kan = kan or PhysicsInformedKAN()
+
+    rng = np.random.default_rng(seed)
+    hr = rng.uniform(5, 310, n_samples)
+    map_val = rng.uniform(5, 310, n_samples)
+    shape = rng.uniform(0, 5.5, n_samples)
+    valid, physics, risk = exact_path(pinn, kan, hr, map_val, shape)
+    s_valid, s_physics, s_risk = surface.evaluate_batch(hr, map_val, shape)
+
+    idx, frac = surface._corners(hr, map_val)
+    corners = surface.table[idx[:, 0][:, None] + [0, 0, 1, 1], idx[:, 1][:, None] + [0, 1, 0, 1], VALID]
+    smooth = (corners.min(axis=1) == corners.max(axis=1))
+    risk_err = np.abs(s_risk - risk)
+    return {
+        "validity_mismatch": float((s_valid != valid).mean()),
+        "boundary_fraction": float(1.0 - smooth.mean()),
+        "max_risk_err": float(risk_err.max()),
+        "p99_risk_err": float(np.percentile(risk_err, 99)),
+        "max_risk_err_smooth": float(risk_err[smooth].max()),
+        "max_physics_err_smooth": float(np.abs(s_physics - physics)[smooth].max()),
+    }
+
+if __name__ == "__main__":
+    from layer_2_pinn import HemodynamicPINN, PhysicsResult
+    from layer_3_kan import PhysicsInformedKAN, RiskResult
+
+    path = "data/risk_surface"
+    start = time.perf_counter()
+    surface = compile_risk_surface(path)
+    size_mb = os.path.getsize(path + ".npy") / 1e6
+    print(f"Compiled {surface.table.shape} surface in {time.perf_counter() - start:.2f} s ({size_mb:.1f} MB)")
+    print("Error vs exact path:", surface_error(surface))
+
+    # Per-tick cost: exact scalar path (fresh and reused result records) vs compiled lookup
+    pinn, kan = HemodynamicPINN(), PhysicsInformedKAN()
+    rng = np.random.default_rng(1)
+    ticks = np.column_stack([rng.uniform(40, 160, 20000), rng.uniform(30, 130, 20000), rng.uniform(0, 5, 20000)])
+    rows = [np.array(row) for row in ticks[:, :2]]
+    shapes = ticks[:, 2].tolist()
+    start = time.perf_counter()
+    for row, shape in zip(rows, shapes):
+        kan.predict_risk(shape, pinn.validate(row).severity)
+    exact_us = (time.perf_counter() - start) / len(ticks) * 1e6
+    physics_out, risk_out = PhysicsResult(), RiskResult()
+    start = time.perf_counter()
+    for row, shape in zip(rows, shapes):
+        kan.predict_risk(shape, pinn.validate(row, out=physics_out).severity, out=risk_out)
+    reuse_us = (time.perf_counter() - start) / len(ticks) * 1e6
+    scalar = ticks.tolist()
+    start = time.perf_counter()
+    for hr, map_val, shape in scalar:
+        surface.evaluate(hr, map_val, shape)
+    fused_us = (time.perf_counter() - start) / len(ticks) * 1e6
+    print(f"validate + predict_risk: {exact_us:.1f} us/tick (reused records: {reuse_us:.1f}) | "
+          f"fused lookup: {fused_us:.1f} us/tick")
+    scalar_risk = np.array([surface.evaluate(*tick)[2] for tick in scalar[:2000]])
+    print(f"scalar vs batch lookup: max |risk diff| "
+          f"{np.abs(scalar_risk - surface.evaluate_batch(*ticks[:2000].T)[2]).max():.1e}")
+
+    # Cold load in a fresh interpreter must not pull in scipy
+    probe = ("import sys, time; t = time.perf_counter(); from fused_surface import FusedRiskSurface; "
+             f"s = FusedRiskSurface.load('{path}'); s.evaluate(80, 90, 1.0); "
+             "print(f'{(time.perf_counter() - t) * 1e3:.1f}', 'scipy' in sys.modules)")
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    load_ms, scipy_loaded = subprocess.run([sys.executable, "-c", probe], capture_output=True,
+                                           text=True, env=env, check=True).stdout.split()
+    print(f"Cold import + load + first lookup: {load_ms} ms (scipy imported: {scipy_loaded})")
@@ -48,8 +48,10 @@ def generate_physics_distillation_data(n_samples=1000):
         # We simulate shape score probability (higher for chaos inputs)
         shape_score = abs(hr - 75)/30 + abs(map_bp - 90)/30 
         
-        valid, phys_score, reason = pinn.validate(vitals)
-        risk, formula = kan.predict_risk(shape_score, phys_score)
+        physics = pinn.validate(vitals)
+        valid = physics.is_valid
+        result = kan.predict_risk(shape_score, physics.severity)
+        risk = result.risk
         
         # 3. Formulate the "Chain of Thought" Label
         # This is what we want MedGemma to learn to output
@@ -66,7 +68,7 @@ def generate_physics_distillation_data(n_samples=1000):
         completion = {
             "Physics_Check": "Valid" if valid else "Invalid",
             "Risk_Calculation": f"{risk:.0%}",
-            "Reasoning": reason if not valid else formula,
+            "Reasoning": physics.reason if not valid else result.explanation,
             "Recommended_Action": action
         }
         
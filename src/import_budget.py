@@ -0,0 +1,92 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Cold-import budget per module (ms, cumulative as reported by -X importtime).
+# Heavy dependencies (torch / transformers, giotto-tda / sklearn, plotly) must stay
+# out of module import and load on first use instead.
+BUDGET_MS = {
+    "layer_1_tda": 150,
+    "layer_2_pinn": 150,
+    "layer_3_kan": 500,
+    "layer_4_agent": 50,
+    "mock_stream": 400,
+    "pipeline": 800,
+    "live_worker": 1000,
+    "fused_surface": 150,
+}
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def parse_importtime(stderr, module):
+    """
+    Parse `python -X importtime` output for `module`.
+    Returns (cumulative_us, {direct_import: cumulative_us}).
+    Lines look like "import time:  self [us] | cumulative | imported package",
+    with nested imports indented two spaces per level.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue # header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, name.strip(), cumulative))
+
+    # Children are printed before their parent: walk back from the module's line
+    total, children = None, {}
+    for i, (depth, name, cumulative) in enumerate(rows):
+        if depth == 0 and name == module:
+            total = cumulative
+            for child_depth, child, child_cumulative in reversed(rows[:i]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    children[child] = child_cumulative
+            break
+    return total, children
+
+def import_time(module, runs=3):
+    """
+    Best-of-`runs` cold import of `module` in a fresh interpreter (run from src/).
+    """
+    best = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, cwd=SRC_DIR)
+        total, children = parse_importtime(result.stderr, module)
+        if total is None:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+        if best is None or total < best[0]:
+            best = (total, children)
+    return best
+
+def report(modules=None, runs=3):
+    """
+    Print import time vs budget per module. Returns True if all are within budget.
+    """
+    ok = True
+    for module in modules or BUDGET_MS:
+        total, children = import_time(module, runs)
+        budget = BUDGET_MS.get(module)
+        within = budget is None or total / 1e3 <= budget
+        ok &= within
+        heaviest = sorted(children.items(), key=lambda item: -item[1])[:3]
+        detail = ", ".join(f"{name} {us / 1e3:.0f}" for name, us in heaviest)
+        status = "ok" if within else "OVER BUDGET"
+        print(f"{module:<15} {total / 1e3:7.1f} ms / {budget if budget is not None else '-':>5} ms  "
+              f"{status:<12} heaviest: {detail}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-module cold import time vs budget")
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: all budgeted)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(0 if report(args.modules, args.runs) else 1)
@@ -1,14 +1,282 @@
+import os
+import re
+import math
+import time
+import hashlib
 import numpy as np
-from gtda.homology import VietorisRipsPersistence
-from gtda.diagrams import Amplitude
-from sklearn.random_projection import SparseRandomProjection
+from numpy.lib.stride_tricks import sliding_window_view
 import warnings
 
 # Suppress TDA warnings for clean output
 warnings.filterwarnings("ignore")
 
+class RingBuffer:
+    def __init__(self, capacity, dim, n_streams=None, dtype=float):
+        """
+        Preallocated circular buffer of `capacity` vectors of length `dim`.
+
+        "Mirrored" layout: every sample is written twice (at slot h and h + capacity),
+        so the last N samples are ALWAYS one contiguous slice in time order.
+        That means the sliding window comes out as a view: no pop(0), no
+        list -> array rebuild, no per-tick allocation.
+
+        With `n_streams` set, the buffer holds one ring per stream (e.g. per bed)
+        sharing the same write head: data is (n_streams, 2 * capacity, dim).
+        """
+        self.capacity = capacity
+        self.dim = dim
+        lead = () if n_streams is None else (n_streams,)
+        self.data = np.zeros(lead + (2 * capacity, dim), dtype=dtype)
+        self.head = 0 # Next slot to write, in [0, capacity)
+        self.count = 0
+
+    def push(self, x):
+        self.data[..., self.head, :] = x
+        self.data[..., self.head + self.capacity, :] = x
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def window(self, n=None):
+        """
+        View of the last `n` samples (default: all valid ones), oldest first.
+        """
+        n = self.count if n is None else n
+        end = self.head + self.capacity
+        return self.data[..., end - n:end, :]
+
+    def slots(self):
+        """
+        The ring as `capacity` physical slots (the lower half), NOT in time order.
+        """
+        return self.data[..., :self.capacity, :]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+class RollingDistanceMatrix:
+    def __init__(self, ring):
+        """
+        Pairwise distances of the points held in `ring`, indexed by ring SLOT.
+
+        When a point is pushed into slot h only row/column h changes, so each tick
+        costs O(n * d) instead of recomputing all n^2 / 2 pairs. Vietoris-Rips is
+        invariant to point order, so the slot-ordered matrix can go straight to
+        the persistence engine as a precomputed metric.
+        """
+        self.ring = ring
+        lead = ring.data.shape[:-2]
+        n = ring.capacity
+        self.matrix = np.zeros(lead + (n, n))
+        # Scratch buffers so the per-tick update does not allocate
+        self._diff = np.zeros(lead + (n, ring.dim))
+        self._row = np.zeros(lead + (n,))
+
+    def push(self, x):
+        """
+        Push `x` into the ring and refresh its row/column.
+        """
+        h = self.ring.head
+        self.ring.push(x)
+        np.subtract(self.ring.slots(), self.ring.data[..., h:h + 1, :], out=self._diff)
+        np.square(self._diff, out=self._diff)
+        np.sum(self._diff, axis=-1, out=self._row)
+        np.sqrt(self._row, out=self._row)
+        self._row[..., h] = 0.0
+        self.matrix[..., h, :] = self._row
+        self.matrix[..., :, h] = self._row
+
+    def valid_slots(self, n=None):
+        """
+        Slot indices of the newest `n` points (default: all valid ones).
+        """
+        n = self.ring.count if n is None else n
+        return (self.ring.head - n + np.arange(n)) % self.ring.capacity
+
+    def window(self):
+        """
+        Distance matrix of the currently valid points (a view until the ring
+        has wrapped once, and the full matrix after that).
+        """
+        n = self.ring.count
+        if n == self.ring.capacity or self.ring.head == n:
+            return self.matrix[..., :n, :n]
+        idx = self.valid_slots()
+        return self.matrix[..., idx[:, None], idx[None, :]]
+
+class JLProjection:
+    def __init__(self, matrix):
+        """
+        Precompiled Johnson-Lindenstrauss projection: a dense (n_features, n_components)
+        matrix applied with a plain matmul. Built once from sklearn's
+        SparseRandomProjection (same seed -> same 10d space), then saved/reloaded
+        as a .npy so the hot path never touches sklearn.
+        """
+        self.matrix = np.ascontiguousarray(matrix, dtype=float)
+        self.n_features, self.n_components = self.matrix.shape
+
+    @classmethod
+    def build(cls, n_features, n_components=10, random_state=42):
+        # SRP only needs n_features to draw its components, so fit on a dummy row
+        from sklearn.random_projection import SparseRandomProjection # deferred: slow to import
+        srp = SparseRandomProjection(n_components=n_components, random_state=random_state)
+        srp.fit(np.zeros((1, n_features)))
+        return cls(srp.components_.toarray().T)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+    @classmethod
+    def load_or_build(cls, path, n_features, n_components=10, random_state=42):
+        """
+        Reload a persisted projection, or build it and persist it for next time.
+        """
+        if os.path.exists(path):
+            projection = cls.load(path)
+            if projection.matrix.shape == (n_features, n_components):
+                return projection
+        projection = cls.build(n_features, n_components, random_state)
+        projection.save(path)
+        return projection
+
+    def save(self, path):
+        np.save(path, self.matrix)
+
+    def project(self, X, out=None):
+        """
+        (n, n_features) -> (n, n_components). Pass `out` to project without allocating.
+        """
+        return np.dot(X, self.matrix, out=out)
+
+    def project_windows(self, vitals, window_size):
+        """
+        Batch path for whole recordings: every time-delay window of a (T, n_vitals)
+        array, embedded and projected in ONE matmul.
+        Row i is the projection of vitals[i : i + window_size] (time-major flatten,
+        same as the streaming embedding), so there are T - window_size + 1 rows.
+        """
+        vitals = np.ascontiguousarray(vitals, dtype=float)
+        n_vitals = vitals.shape[1]
+        # A time-major window is just a slice of the flattened recording, so every
+        # embedding is a strided view: rows step by n_vitals, width window * n_vitals.
+        flat = vitals.reshape(-1)
+        embedded = sliding_window_view(flat, window_size * n_vitals)[::n_vitals]
+        return embedded @ self.matrix
+
+class StageTimings:
+    # Log-spaced histogram buckets: 8 per octave from 100 ns up to ~100 s
+    BUCKETS_PER_OCTAVE = 8
+    MIN_SECONDS = 1e-7
+    N_BUCKETS = 8 * 30
+
+    def __init__(self):
+        """
+        Streaming per-stage latency histograms for the sensor hot path.
+
+        Recording is one perf_counter() call plus one integer increment into a
+        fixed log-bucketed histogram, so there is no per-sample storage and the
+        percentiles (p50/p95/p99) are read back from bucket counts (~9% resolution).
+        """
+        self.counts = {}
+        self._last = 0.0
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        """
+        Record the time since the previous start()/lap() under `stage`.
+        """
+        now = time.perf_counter()
+        self.record(stage, now - self._last)
+        self._last = now
+
+    def record(self, stage, elapsed):
+        """
+        Record an externally measured duration (seconds) under `stage`.
+        """
+        bucket = 0
+        if elapsed > self.MIN_SECONDS:
+            bucket = min(int(math.log2(elapsed / self.MIN_SECONDS) * self.BUCKETS_PER_OCTAVE),
+                         self.N_BUCKETS - 1)
+        hist = self.counts.get(stage)
+        if hist is None:
+            hist = self.counts[stage] = [0] * self.N_BUCKETS
+        hist[bucket] += 1
+
+    def percentile(self, stage, q):
+        """
+        Upper edge (seconds) of the bucket holding the q-th percentile of `stage`.
+        """
+        hist = self.counts[stage]
+        target = q / 100.0 * sum(hist)
+        seen = 0
+        for bucket, count in enumerate(hist):
+            seen += count
+            if count and seen >= target:
+                return self.MIN_SECONDS * 2 ** ((bucket + 1) / self.BUCKETS_PER_OCTAVE)
+        return 0.0
+
+    def report(self):
+        """
+        {stage: {"count", "p50_ms", "p95_ms", "p99_ms"}}
+        """
+        return {
+            stage: {
+                "count": sum(hist),
+                "p50_ms": self.percentile(stage, 50) * 1e3,
+                "p95_ms": self.percentile(stage, 95) * 1e3,
+                "p99_ms": self.percentile(stage, 99) * 1e3,
+            }
+            for stage, hist in self.counts.items()
+        }
+
+    def reset(self):
+        self.counts = {}
+
+def maxmin_landmarks(dist, n_landmarks, seed=0):
+    """
+    Greedy maxmin landmark selection on a distance matrix: each new landmark is
+    the point farthest from the ones already picked. O(n_landmarks * n).
+    """
+    n_landmarks = min(n_landmarks, len(dist))
+    landmarks = np.empty(n_landmarks, dtype=int)
+    landmarks[0] = seed
+    cover = dist[seed].copy() # Distance of every point to its nearest landmark
+    for i in range(1, n_landmarks):
+        landmarks[i] = np.argmax(cover)
+        np.minimum(cover, dist[landmarks[i]], out=cover)
+    return landmarks
+
+def witness_filtration(dist, landmarks, nu=0):
+    """
+    Lazy witness complex on the landmarks, with every cloud point as a witness.
+    Each witness w first subtracts m_nu(w), its distance to its nu-th nearest
+    landmark (nu = 0: no offset), then edge [a, b] enters at
+    min_w max(d(w, a) - m_nu(w), d(w, b) - m_nu(w), 0). Returned as an
+    (n_landmarks, n_landmarks) matrix that Vietoris-Rips (precomputed) turns into
+    the witness flag complex. Persistence then only sees n_landmarks points.
+
+    nu = 0 is the default because it is the better choice at the cheap landmark
+    counts the backend exists for: with 20 landmarks on a 200-point cloud, nu = 2
+    collapses most edges to 0 (corr 0.24 with exact VR vs 0.61 for nu = 0).
+    nu = 2 only pays off with many landmarks (80 of 200: corr 0.93 vs 0.85).
+    """
+    d_lw = dist[landmarks] # (n_landmarks, n_points)
+    if nu > 0:
+        offset = np.partition(d_lw, nu - 1, axis=0)[nu - 1]
+        d_lw = np.maximum(d_lw - offset, 0.0)
+    filtration = np.maximum(d_lw[:, None, :], d_lw[None, :, :]).min(axis=-1)
+    np.fill_diagonal(filtration, 0.0)
+    return filtration
+
 class TopologicalSensor:
-    def __init__(self, window_size=20, embedding_dim=100, projection_dim=10):
+    def __init__(self, window_size=20, embedding_dim=100, projection_dim=10,
+                 n_vitals=5, cloud_size=50, min_cloud=30, gate_threshold=None, max_hold=10,
+                 projection_path=None, backend="vr", n_landmarks=20, witness_nu=0, witness_audit_every=0,
+                 pyramid=None, timing=False, baseline_store=None, patient_id=None):
         """
         Layer 1: The Topological Sensor.
         
@@ -16,85 +284,586 @@ class TopologicalSensor:
         1. Time-Delay Embedding: 5 vitals * 20 sec history = 100 dimensions.
         2. JL-Projection: 100d -> 10d (Speed Optimization).
         3. TDA: Vietoris-Rips (Approximated) on the projected cloud.
+
+        The cloud's pairwise distances are maintained incrementally (one new
+        row/column per tick) and handed to Vietoris-Rips as a precomputed metric,
+        so `cloud_size` can grow well beyond 50 without O(n^2 * d) rebuilds.
+
+        The JL matrix is built once at construction (or reloaded from
+        `projection_path`, see JLProjection) and applied as a direct matmul.
+
+        Gating (optional): with `gate_threshold` set, persistence only reruns when
+        the cloud has drifted (centroid shift + variance change since the last
+        recompute, both scale-free) past the threshold, or after `max_hold` ticks.
+        Otherwise the last Shape Score is held. `n_recomputed` / `n_skipped`
+        count the two outcomes.
+
+        Backends: "vr" (default) is exact Vietoris-Rips on the whole cloud. "witness"
+        picks `n_landmarks` maxmin landmarks and computes a lazy witness complex
+        (see witness_filtration, `witness_nu`), so persistence cost depends on the
+        landmarks and not the cloud size. It is an approximation with its own
+        scale: over the whole mock recording (benchmark_tda.py witness), at
+        cloud_size=200 and 20 landmarks it runs ~1.1 ms/tick vs 10.5 ms for exact
+        VR but correlates only 0.61 with the exact score (mean gap 33% after
+        rescaling); 80 landmarks (nu = 2) reach corr 0.93 / 12% at 5.3 ms. At
+        cloud_size=50 it is no faster than exact VR. With `witness_audit_every=k`,
+        every k-th witness recompute is also scored exactly and the gap is tracked
+        in `backend_drift()`, so callers can check the drift on their own data.
+
+        Pyramid (optional): `pyramid=(10, 60)` keeps block-averaged copies of the
+        stream at 10 s and 60 s resolution, each with its own (same-sized) cloud and
+        score, see TopologyPyramid. Level k only runs every k ticks, so minutes-to-hour
+        horizons cost about the same per tick as the 1 s topology.
+
+        Timing (optional): `timing=True` (or enable_timing()) records per-stage
+        latencies (buffer, pyramid, projection, distances, gate, landmarks,
+        persistence, amplitude) into StageTimings histograms; read them with timing_report().
+        When off, the hot path only pays one `is not None` check per stage.
+
+        Warm Start: get_state()/set_state() serialize the buffers, rolling distances,
+        projection matrix and the healthy-baseline diagram. With a `baseline_store`
+        and `patient_id` the sensor restores that patient's state at construction,
+        so a restarted monitor scores on its first tick instead of after ~50.
+        The first full cloud calibrates the baseline; `normalized_score` is the
+        latest score divided by the baseline score (1.0 = healthy shape).
+        (Pyramid levels are not part of the state and restart cold.)
         """
+        if backend not in ("vr", "witness"):
+            raise ValueError(f"Unknown TDA backend: {backend}")
         self.window_size = window_size
-        self.raw_buffer = [] # Buffer for sliding window of raw vitals
+        self.n_vitals = n_vitals
+        self.cloud_size = cloud_size
+        self.min_cloud = min_cloud
+
+        # Sliding window of raw vitals (ring buffer, [window_size, n_vitals])
+        self.raw_ring = RingBuffer(window_size, n_vitals)
         
         # Johnson-Lindenstrauss Projector
-        # We initialize it once to ensure consistency
-        self.jl_projector = SparseRandomProjection(n_components=projection_dim, random_state=42)
+        # We initialize it once to ensure consistency (persisted if a path is given)
+        n_features = window_size * n_vitals
+        if projection_path is not None:
+            self.jl_projector = JLProjection.load_or_build(projection_path, n_features, projection_dim)
+        else:
+            self.jl_projector = JLProjection.build(n_features, projection_dim)
+        self._val_10d = np.zeros((1, projection_dim)) # Projection output, reused every tick
         
         # TDA Engine
         # We use 'Wasserstein' amplitude as a scalar "Shape Score"
-        self.vr = VietorisRipsPersistence(metric="euclidean", homology_dimensions=[0, 1])
+        # giotto-tda is deferred to first construction (~0.7 s to import)
+        from gtda.homology import VietorisRipsPersistence
+        from gtda.diagrams import Amplitude
+        self.vr = VietorisRipsPersistence(metric="precomputed", homology_dimensions=[0, 1])
         self.amplitude = Amplitude(metric="wasserstein")
         
         # Baseline (Healthy Shape)
         # We need to collect some initial points to define "Normal"
-        self.point_cloud = [] 
+        self.cloud_ring = RingBuffer(cloud_size, projection_dim)
+        self.cloud_dist = RollingDistanceMatrix(self.cloud_ring)
         self.baseline_entropy = 0
+        self.baseline_diagram = None
         self.is_calibrated = False
+        self.normalized_score = None
+
+        # Change Gating (None = recompute every tick, the original behaviour)
+        self.gate_threshold = gate_threshold
+        self.max_hold = max_hold
+        self.last_score = None
+        self.n_recomputed = 0
+        self.n_skipped = 0
+        self._ticks_held = 0
+        self._ref_mean = None
+        self._ref_var = None
+
+        # TDA Backend
+        self.backend = backend
+        self.n_landmarks = n_landmarks
+        self.witness_nu = witness_nu
+        self.witness_audit_every = witness_audit_every
+        self._n_audits = 0
+        self._audit_abs_sum = 0.0
+        self._audit_abs_max = 0.0
+        self._audit_rel_sum = 0.0
+
+        # Per-stage instrumentation (None = disabled)
+        self.timings = StageTimings() if timing else None
+
+        # Multi-Resolution Pyramid (coarse levels reuse this sensor's configuration)
+        self.pyramid = None
+        if pyramid:
+            self.pyramid = TopologyPyramid(
+                pyramid, window_size=window_size, projection_dim=projection_dim,
+                n_vitals=n_vitals, cloud_size=cloud_size, min_cloud=min_cloud,
+                gate_threshold=gate_threshold, max_hold=max_hold,
+                backend=backend, n_landmarks=n_landmarks, witness_nu=witness_nu,
+                witness_audit_every=witness_audit_every,
+            )
+
+        # Warm Start from a persisted per-patient baseline
+        if baseline_store is not None and patient_id is not None:
+            baseline_store.restore(patient_id, self)
+
+    @property
+    def raw_buffer(self):
+        """Last `window_size` raw vitals, oldest first (view, not a copy)."""
+        return self.raw_ring.window()
+
+    @property
+    def point_cloud(self):
+        """Current projected cloud, oldest first (view, not a copy)."""
+        return self.cloud_ring.window()
+
+    def cloud_drift(self):
+        """
+        Cheap drift statistic of the current cloud vs the cloud at the last recompute:
+        centroid displacement (in units of the reference spread) + relative variance change.
+        """
+        cloud = self.cloud_ring.window()
+        mean = cloud.mean(axis=0)
+        var = cloud.var(axis=0).sum()
+        if self._ref_mean is None:
+            return np.inf, mean, var
+        ref_var = max(self._ref_var, 1e-12)
+        shift = np.sqrt(np.sum((mean - self._ref_mean) ** 2) / ref_var)
+        return shift + abs(var / ref_var - 1.0), mean, var
+
+    def persistence_score(self, dist):
+        """
+        H1 Wasserstein amplitude of the Vietoris-Rips diagram of a distance matrix.
+        """
+        timings = self.timings
+        diagrams = self.vr.fit_transform(dist[None, :, :]) # Shape for gtda: (1, n, n)
+        if timings is not None: timings.lap("persistence")
+        
+        # How "big" are the holes compared to empty space?
+        # Higher amplitude = More complex topology = Instability/Sepsis
+        score = float(self.amplitude.fit_transform(diagrams)[0][1]) # H1 score
+        if timings is not None: timings.lap("amplitude")
+        return score
+
+    def enable_timing(self):
+        if self.timings is None:
+            self.timings = StageTimings()
+
+    def disable_timing(self):
+        self.timings = None
+
+    def timing_report(self):
+        """
+        p50/p95/p99 (ms) per stage since timing was enabled; {} when disabled.
+        """
+        return self.timings.report() if self.timings is not None else {}
+
+    def tda_distance(self):
+        """
+        The matrix persistence runs on for the current cloud (backend-specific).
+        """
+        dist = self.cloud_dist.window()
+        if self.backend == "witness":
+            return witness_filtration(dist, maxmin_landmarks(dist, self.n_landmarks), nu=self.witness_nu)
+        return dist
+
+    def calibrate_baseline(self):
+        """
+        Declare the current cloud "healthy": keep its diagram and H1 score as the baseline.
+        """
+        diagrams = self.vr.fit_transform(self.tda_distance()[None, :, :])
+        self.baseline_diagram = diagrams[0]
+        self.baseline_entropy = float(self.amplitude.fit_transform(diagrams)[0][1])
+        self.is_calibrated = True
+
+    def get_state(self):
+        """
+        Everything needed to resume this sensor elsewhere, as a dict of numpy arrays.
+        """
+        return {
+            "window_size": np.array(self.window_size),
+            "n_vitals": np.array(self.n_vitals),
+            "cloud_size": np.array(self.cloud_size),
+            "projection": self.jl_projector.matrix.copy(),
+            "raw_data": self.raw_ring.data.copy(),
+            "raw_head": np.array(self.raw_ring.head),
+            "raw_count": np.array(self.raw_ring.count),
+            "cloud_data": self.cloud_ring.data.copy(),
+            "cloud_head": np.array(self.cloud_ring.head),
+            "cloud_count": np.array(self.cloud_ring.count),
+            "cloud_dist": self.cloud_dist.matrix.copy(),
+            "last_score": np.array(np.nan if self.last_score is None else self.last_score),
+            "baseline_diagram": np.zeros((0, 3)) if self.baseline_diagram is None else self.baseline_diagram.copy(),
+            "baseline_entropy": np.array(self.baseline_entropy),
+            "is_calibrated": np.array(self.is_calibrated),
+        }
+
+    def set_state(self, state):
+        """
+        Resume from get_state() output. The geometry must match this sensor's.
+        """
+        for key, value in (("window_size", self.window_size), ("n_vitals", self.n_vitals),
+                           ("cloud_size", self.cloud_size)):
+            if int(state[key]) != value:
+                raise ValueError(f"Sensor state mismatch: {key}={int(state[key])}, expected {value}")
+
+        self.jl_projector = JLProjection(state["projection"])
+        self._val_10d = np.zeros((1, self.jl_projector.n_components))
+        self.raw_ring.data[...] = state["raw_data"]
+        self.raw_ring.head = int(state["raw_head"])
+        self.raw_ring.count = int(state["raw_count"])
+        self.cloud_ring.data[...] = state["cloud_data"]
+        self.cloud_ring.head = int(state["cloud_head"])
+        self.cloud_ring.count = int(state["cloud_count"])
+        self.cloud_dist.matrix[...] = state["cloud_dist"]
+
+        last_score = float(state["last_score"])
+        self.last_score = None if np.isnan(last_score) else last_score
+        self.is_calibrated = bool(state["is_calibrated"])
+        self.baseline_diagram = state["baseline_diagram"] if self.is_calibrated else None
+        self.baseline_entropy = float(state["baseline_entropy"])
+        self._ref_mean = None # Force the gate to recompute on the first tick
+        self._ticks_held = 0
+
+    @classmethod
+    def from_state(cls, state, **kwargs):
+        sensor = cls(window_size=int(state["window_size"]), n_vitals=int(state["n_vitals"]),
+                     cloud_size=int(state["cloud_size"]),
+                     projection_dim=state["projection"].shape[1], **kwargs)
+        sensor.set_state(state)
+        return sensor
+
+    def horizon_scores(self):
+        """
+        Latest Shape Score per resolution, keyed by seconds-per-sample (1 = this sensor).
+        """
+        scores = {1: self.last_score or 0.0}
+        if self.pyramid is not None:
+            scores.update(self.pyramid.scores)
+        return scores
+
+    def backend_drift(self):
+        """
+        How far the witness backend's scores sit from exact Vietoris-Rips,
+        over the audited recomputes so far (absolute and relative to the exact score).
+        """
+        n = self._n_audits
+        return {
+            "n_audits": n,
+            "mean_abs": self._audit_abs_sum / n if n else 0.0,
+            "max_abs": self._audit_abs_max,
+            "mean_rel": self._audit_rel_sum / n if n else 0.0,
+        }
 
     def update(self, vital_chunk):
         """
         Ingest new data, update sliding window, project, and return Shape Score.
         """
+        timings = self.timings
+        if timings is not None: timings.start()
+
         # 1. Update Raw Buffer
-        # Flatten chunk if needed, assuming chunk is a single row [HR, MAP, SpO2, Temp]
-        if isinstance(vital_chunk, np.ndarray):
-             vals = vital_chunk.flatten().tolist()
-        else:
-             # Pandas series
-             vals = vital_chunk.values.flatten().tolist()
-             
-        # Just keep track of the last 'window_size' vectors
-        # Logic: We need 'window_size' steps to form ONE 100d point.
-        # But to do TDA, we need a CLOUD of points.
-        # So we maintain a buffer of raw history. 
-        self.raw_buffer.append(vals)
-        if len(self.raw_buffer) > self.window_size:
-            self.raw_buffer.pop(0)
+        # Chunk is a single row [HR, MAP, SpO2, Temp, RR] (ndarray or pandas Series)
+        if not isinstance(vital_chunk, np.ndarray):
+            vital_chunk = vital_chunk.values
+        self.raw_ring.push(vital_chunk.reshape(-1))
+        if timings is not None: timings.lap("buffer")
+        if self.pyramid is not None:
+            self.pyramid.update(self.raw_ring.window(1)[0])
+            if timings is not None: timings.lap("pyramid")
             
         # We need at least window_size points to create ONE embedded point
-        if len(self.raw_buffer) < self.window_size:
+        if self.raw_ring.count < self.window_size:
             return 0.0 # Not enough data
             
         # 2. Time-Delay Embedding (Create 100d vector)
-        # Flatten the buffer ([20, 5] -> [100])
-        embedded_point = np.array(self.raw_buffer).flatten().reshape(1, -1)
+        # The ring window is contiguous, so [20, 5] -> [1, 100] is a free reshape
+        embedded_point = self.raw_ring.window().reshape(1, -1)
         
         # 3. JL-Projection (100d -> 10d)
-        # We fit the projector on the fly or just transform? 
-        # SRP needs fitting once. We'll fit on the first valid point (dummy fit)
-        # In prod, we'd pre-fit on healthy data.
-        try:
-            val_10d = self.jl_projector.transform(embedded_point)
-        except:
-            # First run, fit it
-            self.jl_projector.fit(embedded_point)
-            val_10d = self.jl_projector.transform(embedded_point)
+        # Precompiled matrix, written into a preallocated output row
+        val_10d = self.jl_projector.project(embedded_point, out=self._val_10d)
+        if timings is not None: timings.lap("projection")
             
         # 4. Form Point Cloud
         # TDA needs a cloud (e.g. last 50 states).
-        self.point_cloud.append(val_10d[0])
-        if len(self.point_cloud) > 50: # Keep cloud size fixed at 50
-            self.point_cloud.pop(0)
+        # Pushing through the distance matrix refreshes only the new point's row.
+        self.cloud_dist.push(val_10d[0])
+        if timings is not None: timings.lap("distances")
             
-        if len(self.point_cloud) < 30:
+        if self.cloud_ring.count < self.min_cloud:
             return 0.0 # Calibration phase
+
+        # 4b. Change Gate: hold the last score while the cloud is quiet
+        if self.gate_threshold is not None:
+            drift, mean, var = self.cloud_drift()
+            if timings is not None: timings.lap("gate")
+            if drift < self.gate_threshold and self._ticks_held < self.max_hold:
+                self._ticks_held += 1
+                self.n_skipped += 1
+                return self.last_score
+            self._ref_mean, self._ref_var = mean, var
+            self._ticks_held = 0
             
-        # 5. Run TDA
-        X_cloud = np.array(self.point_cloud)
-        X_cloud = X_cloud[None, :, :] # Shape for gtda: (1, n_points, n_dim)
-        
-        diagrams = self.vr.fit_transform(X_cloud)
-        
-        # 6. Calculate Instability (Amplitude)
-        # How "big" are the holes compared to empty space?
-        # Higher amplitude = More complex topology = Instability/Sepsis
-        score = self.amplitude.fit_transform(diagrams)[0][1] # H1 score
-        
-        return float(score)
+        # 5 + 6. Run TDA on the rolling distance matrix -> Instability (Amplitude)
+        dist = self.cloud_dist.window()
+        if self.backend == "witness":
+            filtration = witness_filtration(dist, maxmin_landmarks(dist, self.n_landmarks), nu=self.witness_nu)
+            if timings is not None: timings.lap("landmarks")
+            score = self.persistence_score(filtration)
+            if self.witness_audit_every and self.n_recomputed % self.witness_audit_every == 0:
+                exact = self.persistence_score(dist)
+                gap = abs(score - exact)
+                self._n_audits += 1
+                self._audit_abs_sum += gap
+                self._audit_abs_max = max(self._audit_abs_max, gap)
+                self._audit_rel_sum += gap / max(exact, 1e-12)
+        else:
+            score = self.persistence_score(dist)
+
+        # 7. Baseline: the first full cloud defines "Normal" for this patient
+        if not self.is_calibrated and self.cloud_ring.count == self.cloud_size:
+            self.calibrate_baseline()
+        if self.is_calibrated:
+            self.normalized_score = score / max(self.baseline_entropy, 1e-6)
+
+        self.last_score = score
+        self.n_recomputed += 1
+        return self.last_score
+
+    def score_recording(self, vitals, n_jobs=None, batch_size=1000):
+        """
+        Offline Shape Scores for a whole recording, without replaying `update`.
+
+        Embeds and projects every window in one matmul, gathers every sliding cloud
+        (growing clouds during calibration, then fixed `cloud_size`), and runs them
+        through gtda in batches spread over `n_jobs`. Returns one score per input
+        row, with the same values streaming replay gives (ungated), including the
+        0.0 warm-up entries. Does not touch the streaming state.
+
+        Cost is bounded by exact persistence: one VR diagram per cloud is still
+        computed (~0.63 ms per 50-point cloud, 98% of the time here), so on a
+        single core a 6000-row recording takes ~3.8 s vs ~8.1 s of streaming
+        replay (47%). Going below that needs n_jobs > 1 on a multi-core host.
+        """
+        if not isinstance(vitals, np.ndarray):
+            vitals = vitals.values # pandas DataFrame
+        n_rows = len(vitals)
+        scores = np.zeros(n_rows)
+        if n_rows < self.window_size:
+            return scores
+
+        # 1-3. Embedding + JL-Projection for the whole recording
+        points = self.jl_projector.project_windows(vitals, self.window_size)
+
+        # 4. Sliding clouds: point j is the newest point of the cloud at row j + window_size - 1
+        n_points = len(points)
+        first = self.min_cloud - 1
+        if first >= n_points:
+            return scores
+        clouds = []
+        for j in range(first, min(self.cloud_size - 1, n_points)):
+            clouds.append(points[:j + 1]) # Still growing (calibration -> full)
+        if n_points >= self.cloud_size:
+            full = sliding_window_view(points, self.cloud_size, axis=0).transpose(0, 2, 1)
+        else:
+            full = points[:0, None, :]
+
+        # 5-6. Batched TDA + Amplitude
+        from gtda.homology import VietorisRipsPersistence
+        from gtda.diagrams import Amplitude
+        vr = VietorisRipsPersistence(metric="euclidean", homology_dimensions=[0, 1], n_jobs=n_jobs)
+        amplitude = Amplitude(metric="wasserstein", n_jobs=n_jobs)
+        out = []
+        if clouds:
+            out.append(amplitude.fit_transform(vr.fit_transform(clouds))[:, 1])
+        for start in range(0, len(full), batch_size):
+            batch = full[start:start + batch_size]
+            out.append(amplitude.fit_transform(vr.fit_transform(batch))[:, 1])
+
+        scores[first + self.window_size - 1:] = np.concatenate(out)
+        return scores
+
+class TopologyPyramid:
+    def __init__(self, factors=(10, 60), **sensor_kwargs):
+        """
+        Incrementally downsampled copies of one vitals stream.
+
+        Level k averages blocks of k raw samples and feeds each block mean into its
+        own TopologicalSensor. Levels cascade (the 60 s level eats 6 block means of
+        the 10 s level), so each tick is one running-sum add per level plus, rarely,
+        one coarse sensor update. Memory is fixed: one accumulator + one sensor per level.
+        """
+        self.factors = tuple(sorted(factors))
+        ratios = []
+        previous = 1
+        for factor in self.factors:
+            if factor % previous:
+                raise ValueError(f"Pyramid factors must divide each other: {self.factors}")
+            ratios.append(factor // previous)
+            previous = factor
+        self.ratios = ratios
+
+        n_vitals = sensor_kwargs.get("n_vitals", 5)
+        self.sensors = [TopologicalSensor(**sensor_kwargs) for _ in self.factors]
+        self._sums = np.zeros((len(self.factors), n_vitals))
+        self._counts = [0] * len(self.factors)
+        self.scores = {factor: 0.0 for factor in self.factors}
+
+    def horizon_seconds(self, factor):
+        """
+        Seconds of history behind one score at level `factor` (1 Hz input).
+        """
+        sensor = self.sensors[self.factors.index(factor)]
+        return factor * (sensor.window_size + sensor.cloud_size - 1)
+
+    def update(self, vitals):
+        x = vitals
+        for level, (factor, ratio) in enumerate(zip(self.factors, self.ratios)):
+            self._sums[level] += x
+            self._counts[level] += 1
+            if self._counts[level] < ratio:
+                break
+            # Block complete: its mean is one sample at this level and the input to the next
+            x = self._sums[level] / ratio
+            self._sums[level] = 0.0
+            self._counts[level] = 0
+            self.scores[factor] = self.sensors[level].update(x)
+
+class BaselineStore:
+    # Patient ids used verbatim as file names
+    SAFE_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+    def __init__(self, root="data/baselines"):
+        """
+        Per-patient sensor baselines on disk (one .npz of get_state() per patient),
+        so a monitor restart or a bed move resumes instead of recalibrating.
+        """
+        self.root = root
+
+    def path(self, patient_id):
+        """
+        File for `patient_id`, always directly inside `root`. Ids made only of
+        [A-Za-z0-9_-] are used as-is; anything else (separators, "..", drive
+        letters) is replaced by "_" and suffixed with a hash of the full id, so
+        distinct ids never share a file.
+        """
+        patient_id = str(patient_id)
+        if self.SAFE_ID.fullmatch(patient_id):
+            safe_id = patient_id
+        else:
+            digest = hashlib.sha1(patient_id.encode("utf-8")).hexdigest()[:12]
+            safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", patient_id)[:40] + "-" + digest
+        return os.path.join(self.root, f"{safe_id}.npz")
+
+    def save(self, patient_id, sensor):
+        os.makedirs(self.root, exist_ok=True)
+        np.savez(self.path(patient_id), **sensor.get_state())
+
+    def load(self, patient_id):
+        path = self.path(patient_id)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            return {key: f[key] for key in f.files}
+
+    def restore(self, patient_id, sensor):
+        """
+        Load `patient_id`'s state into `sensor`. Returns False if there is none.
+        """
+        state = self.load(patient_id)
+        if state is None:
+            return False
+        sensor.set_state(state)
+        return True
+
+class WardTopologicalSensor:
+    def __init__(self, n_beds, n_vitals=5, window_size=20, projection_dim=10,
+                 cloud_size=50, min_cloud=30, n_jobs=None):
+        """
+        Layer 1 (Ward Mode): One sensor for a whole ward.
+
+        Same math as TopologicalSensor, but every tick ingests an (n_beds, n_vitals)
+        array. Each bed keeps its own raw window and point cloud, and persistence
+        for every bed that is ready runs as ONE batched gtda call
+        (n_beds, cloud_size, projection_dim), spread across `n_jobs` workers.
+        """
+        self.n_beds = n_beds
+        self.n_vitals = n_vitals
+        self.window_size = window_size
+        self.cloud_size = cloud_size
+        self.min_cloud = min_cloud
+
+        # Per-bed state: one ring per bed, all sharing the same write head.
+        # Every bed is written every tick; per-bed counts say how many of the
+        # newest samples are valid (a bed reset mid-stream just zeroes its count).
+        self.raw_ring = RingBuffer(window_size, n_vitals, n_streams=n_beds)
+        self.raw_count = np.zeros(n_beds, dtype=int)
+        self.cloud_ring = RingBuffer(cloud_size, projection_dim, n_streams=n_beds)
+        self.cloud_dist = RollingDistanceMatrix(self.cloud_ring)
+        self.cloud_count = np.zeros(n_beds, dtype=int)
+        self.scores = np.zeros(n_beds)
+
+        # Shared JL Projector (same seed as the single-bed sensor -> same 10d space)
+        self.jl_projector = JLProjection.build(window_size * n_vitals, projection_dim)
+
+        # Batched TDA Engine
+        from gtda.homology import VietorisRipsPersistence
+        from gtda.diagrams import Amplitude
+        self.vr = VietorisRipsPersistence(metric="precomputed", homology_dimensions=[0, 1], n_jobs=n_jobs)
+        self.amplitude = Amplitude(metric="wasserstein", n_jobs=n_jobs)
+
+    def reset_bed(self, bed):
+        """
+        New patient in `bed`: drop its history so it recalibrates from scratch.
+        """
+        self.raw_count[bed] = 0
+        self.cloud_count[bed] = 0
+        self.scores[bed] = 0.0
+
+    def update(self, ward_vitals):
+        """
+        Ingest one (n_beds, n_vitals) tick and return the (n_beds,) Shape Scores.
+        Beds still filling their window / cloud report 0.0, like the single sensor.
+        """
+        vals = np.asarray(ward_vitals, dtype=float).reshape(self.n_beds, self.n_vitals)
+
+        # 1. Update Raw Buffers (all beds at once)
+        self.raw_ring.push(vals)
+        np.minimum(self.raw_count + 1, self.window_size, out=self.raw_count)
+
+        embed_beds = self.raw_count == self.window_size
+        if not embed_beds.any():
+            return self.scores.copy()
+
+        # 2 + 3. Time-Delay Embedding + JL-Projection (one transform for the ward)
+        # Beds that are still filling project garbage, but it never becomes "valid"
+        # because their cloud count stays at 0 until the window is full.
+        embedded = self.raw_ring.window(self.window_size).reshape(self.n_beds, -1)
+        val_10d = self.jl_projector.project(embedded)
+
+        # 4. Form Point Clouds
+        self.cloud_dist.push(val_10d)
+        self.cloud_count[embed_beds] = np.minimum(self.cloud_count[embed_beds] + 1, self.cloud_size)
+
+        ready = np.flatnonzero(self.cloud_count >= self.min_cloud)
+        if len(ready) == 0:
+            return self.scores.copy()
+
+        # 5. Run TDA (single batched call on the rolling distance matrices)
+        # Beds admitted at different times can have different cloud sizes;
+        # gtda takes a list of matrices in that case.
+        counts = self.cloud_count[ready]
+        dist = self.cloud_dist.matrix
+        if np.all(counts == self.cloud_size):
+            X_dist = dist if len(ready) == self.n_beds else dist[ready]
+        else:
+            X_dist = []
+            for b, c in zip(ready, counts):
+                idx = self.cloud_dist.valid_slots(c)
+                X_dist.append(dist[b][np.ix_(idx, idx)])
+
+        diagrams = self.vr.fit_transform(X_dist)
+
+        # 6. Calculate Instability (Amplitude), H1 column
+        self.scores[ready] = self.amplitude.fit_transform(diagrams)[:, 1]
+
+        return self.scores.copy()
 
 if __name__ == "__main__":
     # Test Driver
@@ -105,7 +874,7 @@ if __name__ == "__main__":
     print("Simulating Healthy Data...")
     for i in range(100):
         # 5 random "Healthy" vitals
-        data = np.random.normal([75, 90, 98, 37], 1) 
+        data = np.random.normal([75, 90, 98, 37, 16], 1)
         score = sensor.update(data)
         if i % 20 == 0: print(f"Time {i}: Shape Score={score:.4f}")
         
@@ -114,6 +883,6 @@ if __name__ == "__main__":
     for i in range(100):
         # Drifting vitals
         drift = i * 0.5
-        data = np.random.normal([75+drift, 90-drift, 98, 37+drift], 2)
+        data = np.random.normal([75+drift, 90-drift, 98, 37+drift, 16+drift], 2)
         score = sensor.update(data)
         if i % 20 == 0: print(f"Time {i}: Shape Score={score:.4f}")
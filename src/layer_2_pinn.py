@@ -1,5 +1,261 @@
+import time
 import numpy as np
 
+# Compact reason codes for the batch API (text is only built on demand, see explain())
+REASON_VALID = 0
+REASON_IMPOSSIBLE_BP = 1
+REASON_IMPOSSIBLE_HR = 2
+REASON_ZERO_CO = 3
+REASON_SVR_IMPOSSIBLE = 4
+
+class PhysicsResult:
+    """
+    One validate() result: validity, severity, reason code and SVR.
+    The reason text is only formatted when `reason` is read. Unpacks like the
+    old (is_valid, physics_score, reason) tuple.
+    """
+    __slots__ = ("is_valid", "severity", "code", "svr")
+
+    def __init__(self, is_valid=False, severity=0.0, code=REASON_VALID, svr=np.nan):
+        self.is_valid = is_valid
+        self.severity = severity
+        self.code = code
+        self.svr = svr
+
+    @property
+    def reason(self):
+        return HemodynamicPINN.explain(self.code, self.svr)
+
+    def __iter__(self):
+        return iter((self.is_valid, self.severity, self.reason))
+
+    def __repr__(self):
+        return f"PhysicsResult(is_valid={self.is_valid}, severity={self.severity:.2f}, reason={self.reason!r})"
+
+class StrokeVolumeEstimator:
+    # State indices and observation rows (log space)
+    SV, SVR, GAIN = 0, 1, 2
+    H_MAP = np.array([1.0, 1.0, 0.0])  # log(80000 * MAP / HR) = log SV + log SVR
+    H_PP = np.array([1.0, 0.0, -1.0])  # log PP = log SV - log gain
+    H_REF = np.array([1.0, 0.0, 0.0])  # log SV (reference measurement)
+
+    def __init__(self, n_beds=1, sv_prior=70.0, svr_prior=1000.0, pp_gain_prior=70.0 / 40.0,
+                 sv_reversion=1.0 / 36000, sv_drift=1e-3, svr_drift=1e-2, gain_drift=1e-4,
+                 measurement_noise=0.05, pp_noise=0.1, reference_noise=0.05, baseline_window=600):
+        """
+        Online per-patient latent hemodynamics (SV, SVR, PP->SV gain, baseline SVR) for many beds.
+
+        A 3-state Kalman filter per bed in log space, vectorized over beds:
+            x = [log SV, log SVR, log gain]                 (gain: ml of SV per mmHg of PP)
+            y_map = log(80000 * MAP / HR) = log SV + log SVR (MAP = CO * SVR / 80, CO = HR * SV / 1000)
+            y_pp  = log PP = log SV - log gain               (optional pulse pressure)
+            y_ref = log SV                                   (optional reference SV, calibrate())
+        log SV slowly reverts to the population prior (`sv_reversion` per tick), log SVR
+        is a random walk and the gain (arterial compliance) drifts very slowly.
+        Every tick is O(1) per bed: no history is kept or refit.
+
+        MAP/HR only pins SV * SVR and PP only pins SV / gain, so without a reference
+        SV the absolute level stays at the prior (the gain prior is loose, so a
+        patient whose PP runs high or low is not mistaken for a larger or smaller
+        heart); PP then carries relative SV changes. One reference SV (echo,
+        thermodilution) learns the bed's gain, after which PP tracks absolute SV.
+
+        `baseline_svr` is an EWMA of the SVR estimate over ~`baseline_window` ticks.
+        """
+        self.n_beds = n_beds
+        self.prior = np.log([sv_prior, svr_prior, pp_gain_prior])
+        self.prior_var = np.array([0.2, 0.5, 0.4]) ** 2 # SV +/- ~20%, SVR and gain loose
+        self.rho = 1.0 - sv_reversion
+        self.q = np.array([sv_drift, svr_drift, gain_drift]) ** 2
+        self.r_map = measurement_noise ** 2
+        self.r_pp = pp_noise ** 2
+        self.r_ref = reference_noise ** 2
+        self.baseline_alpha = 1.0 / baseline_window
+
+        self.x = np.zeros((n_beds, 3))
+        self.p = np.zeros((n_beds, 3, 3))
+        self.baseline_svr = np.zeros(n_beds)
+        self.n_updates = np.zeros(n_beds, dtype=int)
+        self.reset_bed(slice(None))
+
+    def reset_bed(self, bed):
+        """
+        New patient in `bed` (index, slice or mask): back to the population prior.
+        """
+        self.x[bed] = self.prior
+        self.p[bed] = np.diag(self.prior_var)
+        self.baseline_svr[bed] = np.exp(self.prior[self.SVR])
+        self.n_updates[bed] = 0
+
+    @property
+    def sv(self):
+        return np.exp(self.x[:, self.SV])
+
+    @property
+    def svr(self):
+        return np.exp(self.x[:, self.SVR])
+
+    @property
+    def pp_gain(self):
+        return np.exp(self.x[:, self.GAIN])
+
+    def _observe(self, h, y, r, mask):
+        # Scalar-measurement Kalman update y = h . x + noise(r) for the beds in `mask`
+        ph = self.p @ h
+        s = ph @ h + r
+        k = np.where(mask[:, None], ph / s[:, None], 0.0)
+        innov = np.where(mask, y - self.x @ h, 0.0)
+        self.x += k * innov[:, None]
+        self.p -= k[:, :, None] * ph[:, None, :]
+
+    def calibrate(self, reference_sv, bed=None):
+        """
+        Reference SV measurement(s) in ml: (n_beds,) with NaN where absent, or a
+        scalar for one `bed`. Pins the bed's absolute SV and, through the PP
+        readings, its PP->SV gain.
+        """
+        if bed is not None:
+            ref = np.full(self.n_beds, np.nan)
+            ref[bed] = reference_sv
+            reference_sv = ref
+        ref = np.asarray(reference_sv, dtype=float)
+        has_ref = np.isfinite(ref) & (ref > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self._observe(self.H_REF, np.log(ref), self.r_ref, has_ref)
+
+    def update(self, hr, map_val, pulse_pressure=None):
+        """
+        One tick for every bed: hr, map_val (and optional pulse_pressure) are (n_beds,).
+        Beds with implausible readings (hard filter) are skipped this tick.
+        Returns the per-bed SV estimate (ml/beat).
+        """
+        hr = np.asarray(hr, dtype=float)
+        map_val = np.asarray(map_val, dtype=float)
+        ok = (hr >= 10) & (hr <= 300) & (map_val >= 10) & (map_val <= 300)
+
+        # 1. Predict: SV reverts toward the prior, SVR and gain random-walk
+        mu = self.prior[self.SV]
+        self.x[ok, self.SV] = mu + self.rho * (self.x[ok, self.SV] - mu)
+        p = self.p[ok]
+        p[:, self.SV, :] *= self.rho
+        p[:, :, self.SV] *= self.rho
+        p += np.diag(self.q)
+        self.p[ok] = p
+
+        # 2. Update with MAP / HR
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self._observe(self.H_MAP, np.log(80000.0 * map_val / hr), self.r_map, ok)
+
+        # 3. Optional pulse pressure
+        if pulse_pressure is not None:
+            pp = np.asarray(pulse_pressure, dtype=float)
+            has_pp = ok & (pp > 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self._observe(self.H_PP, np.log(pp), self.r_pp, has_pp)
+
+        # 4. Baseline SVR (EWMA, seeded by the first valid estimate)
+        svr = self.svr
+        first = ok & (self.n_updates == 0)
+        self.baseline_svr = np.where(first, svr, self.baseline_svr)
+        blend = ok & ~first
+        self.baseline_svr[blend] += self.baseline_alpha * (svr[blend] - self.baseline_svr[blend])
+        self.n_updates += ok
+
+        return self.sv
+
+class RollingTrend:
+    def __init__(self, n_beds, window):
+        """
+        Rolling mean / variance / slope of one signal over the last `window` ticks,
+        for many beds at once. O(1) per tick: sliding Welford update for mean and
+        M2 (add newest, drop oldest) and running sums for the least-squares slope,
+        so the window is never re-scanned. Slope is in units per tick.
+        """
+        self.window = window
+        self.values = np.zeros((n_beds, window)) # Ring of raw values (only to know what drops out)
+        self.head = 0
+        self.count = 0
+        self.mean = np.zeros(n_beds)
+        self.m2 = np.zeros(n_beds)
+        self.sum_y = np.zeros(n_beds)
+        self.sum_ty = np.zeros(n_beds) # sum of i * y_i, i = 0 for the oldest sample
+
+    def update(self, x):
+        n = self.window
+        if self.count < n:
+            # Growing window: plain Welford add
+            self.count += 1
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (x - self.mean)
+            self.sum_ty += (self.count - 1) * x
+            self.sum_y += x
+        else:
+            # Full window: add x, drop the oldest sample
+            old = self.values[:, self.head]
+            new_mean = self.mean + (x - old) / n
+            self.m2 += (x - old) * (x - new_mean + old - self.mean)
+            self.mean = new_mean
+            self.sum_ty += (n - 1) * x - (self.sum_y - old)
+            self.sum_y += x - old
+        self.values[:, self.head] = x
+        self.head = (self.head + 1) % n
+
+    @property
+    def var(self):
+        return np.maximum(self.m2, 0.0) / max(self.count - 1, 1)
+
+    @property
+    def slope(self):
+        c = self.count
+        if c < 2:
+            return np.zeros_like(self.mean)
+        t_mean = (c - 1) / 2.0
+        return (self.sum_ty - t_mean * self.sum_y) / (c * (c * c - 1) / 12.0)
+
+class PhysicsTrendMonitor:
+    def __init__(self, n_beds, windows=(30, 300)):
+        """
+        Stateful Layer 2: rolling trends of SVR and of the physics residual
+        (log SVR vs the patient's baseline SVR) per bed, over each window in `windows`.
+
+        Trend severity uses the longest window: the rolling mean SVR projected one
+        window ahead along its slope, mapped like the instantaneous severity
+        (1 = healthy, 0 = shock). A few-tick artifact barely moves it; a sustained
+        SVR collapse drives it down.
+        """
+        self.windows = tuple(windows)
+        self.svr = {w: RollingTrend(n_beds, w) for w in self.windows}
+        self.residual = {w: RollingTrend(n_beds, w) for w in self.windows}
+        self._last_svr = None
+
+    def update(self, svr, baseline_svr):
+        """
+        One tick of SVR (NaN where invalid) and baseline SVR per bed -> trend severity.
+        Invalid readings carry the previous value forward so one bad sample does not
+        poison the running sums.
+        """
+        svr = np.asarray(svr, dtype=float)
+        if self._last_svr is None:
+            self._last_svr = np.where(np.isnan(svr), baseline_svr, svr)
+        svr = np.where(np.isnan(svr), self._last_svr, svr)
+        self._last_svr = svr
+        residual = np.log(svr / baseline_svr)
+        for w in self.windows:
+            self.svr[w].update(svr)
+            self.residual[w].update(residual)
+
+        longest = self.svr[self.windows[-1]]
+        projected = longest.mean + longest.slope * longest.window
+        return np.clip((projected - 400) / 600, 0, 1)
+
+    def stats(self, signal="svr", window=None):
+        """
+        (mean, var, slope) arrays for `signal` ("svr" or "residual") over `window`.
+        """
+        trend = getattr(self, signal)[window or self.windows[-1]]
+        return trend.mean, trend.var, trend.slope
+
 class HemodynamicPINN:
     def __init__(self):
         """
@@ -19,11 +275,22 @@ class HemodynamicPINN:
         # In a real system, SV is estimated from Pulse Pressure (PP = SBP - DBP)
         self.estimated_sv = 70.0 
 
-    def validate(self, vitals):
+        # Per-patient SV (optional): see track_batch() / StrokeVolumeEstimator
+        self.sv_estimator = None
+
+        # Rolling trends (optional): see validate_trend_batch() / PhysicsTrendMonitor
+        self.trend_windows = (30, 300)
+        self.trend_monitor = None
+
+    def validate(self, vitals, out=None):
         """
         Checks if the vitals obey the Laws of Physics.
-        Returns: (is_valid, physics_score, reason)
+        Returns: PhysicsResult (unpacks as (is_valid, physics_score, reason)).
+        With `out` given, that PhysicsResult is filled in place and returned.
         """
+        result = PhysicsResult() if out is None else out
+        result.svr = np.nan
+
         # Unpack
         # vitals: [HR, MAP, SpO2, Temp]
         if isinstance(vitals, np.ndarray):
@@ -34,9 +301,9 @@ class HemodynamicPINN:
         
         # 0. Sanity Check (The "Hard" Filter)
         if map_val > 300 or map_val < 10:
-            return False, 0.0, "Impossible BP"
+            return self._reject(result, REASON_IMPOSSIBLE_BP)
         if hr > 300 or hr < 10:
-            return False, 0.0, "Impossible HR"
+            return self._reject(result, REASON_IMPOSSIBLE_HR)
 
         # 1. Calculate Latent Variables (The "Hidden" Physics)
         # CO (L/min) = (HR * SV) / 1000
@@ -44,9 +311,10 @@ class HemodynamicPINN:
         
         # SVR (dynes/sec/cm-5) = 80 * MAP / CO
         if co == 0: 
-            return False, 0.0, "Zero Cardiac Output"
+            return self._reject(result, REASON_ZERO_CO)
             
         svr = 80 * map_val / co
+        result.svr = svr
         
         # 2. Residual Analysis (The "Soft" Filter)
         # "Normal" SVR is 800-1200.
@@ -55,7 +323,7 @@ class HemodynamicPINN:
         
         if svr < 100 or svr > 5000:
             # Huge Residual -> Physics Violation
-            return False, 0.0, f"Physics Violation (SVR={svr:.0f} impossible)"
+            return self._reject(result, REASON_SVR_IMPOSSIBLE)
             
         # 3. Gated Mixture / Severity Scoring
         # If SVR is valid but LOW, it supports the "Shock" hypothesis.
@@ -63,9 +331,96 @@ class HemodynamicPINN:
         
         # Normalize SVR to a 0-1 score where 1 is healthy (1000) and 0 is dangerous (600)
         # Sigmoid-like mapping
-        severity = np.clip((svr - 400) / 600, 0, 1)
-        
-        return True, severity, f"Valid (SVR={svr:.0f})"
+        result.is_valid = True
+        result.severity = min(max((svr - 400) / 600, 0.0), 1.0)
+        result.code = REASON_VALID
+        return result
+
+    @staticmethod
+    def _reject(result, code):
+        result.is_valid = False
+        result.severity = 0.0
+        result.code = code
+        return result
+
+    def validate_batch(self, vitals, sv=None):
+        """
+        Vectorized validate() for a whole ward or recording.
+
+        vitals: (N, >=2) array, columns [HR, MAP, ...].
+        sv: optional per-row stroke volume (defaults to `estimated_sv`).
+        Returns (valid, severity, reason_code, svr, co) as NumPy arrays of length N.
+        Codes are the REASON_* constants; use explain() for the text, only when shown.
+        SVR / CO are NaN where the hard filter already rejected the row.
+        """
+        vitals = np.asarray(vitals, dtype=float)
+        hr = vitals[:, 0]
+        map_val = vitals[:, 1]
+
+        # 0. Sanity Check (The "Hard" Filter), same precedence as validate()
+        codes = np.zeros(len(vitals), dtype=np.int8)
+        bad_hr = (hr > 300) | (hr < 10)
+        bad_bp = (map_val > 300) | (map_val < 10)
+        codes[bad_hr] = REASON_IMPOSSIBLE_HR
+        codes[bad_bp] = REASON_IMPOSSIBLE_BP
+        hard_ok = codes == REASON_VALID
+
+        # 1. Latent Variables
+        sv = self.estimated_sv if sv is None else sv
+        co = np.where(hard_ok, hr * sv / 1000.0, np.nan)
+        codes[hard_ok & (co == 0)] = REASON_ZERO_CO
+        with np.errstate(divide="ignore", invalid="ignore"):
+            svr = np.where(codes == REASON_VALID, 80 * map_val / co, np.nan)
+
+        # 2. Residual Analysis
+        codes[(codes == REASON_VALID) & ((svr < 100) | (svr > 5000))] = REASON_SVR_IMPOSSIBLE
+        valid = codes == REASON_VALID
+
+        # 3. Severity Scoring (0 where invalid)
+        severity = np.where(valid, np.clip((svr - 400) / 600, 0, 1), 0.0)
+
+        return valid, severity, codes, svr, co
+
+    def track_batch(self, vitals, pulse_pressure=None, reference_sv=None):
+        """
+        Streaming ward mode: update each bed's SV estimate with this tick, then
+        validate the (n_beds, >=2) tick using per-patient SV instead of 70 ml.
+        Optional per-bed `pulse_pressure` and `reference_sv` (NaN where absent),
+        see StrokeVolumeEstimator. Same return values as validate_batch().
+        """
+        vitals = np.asarray(vitals, dtype=float)
+        if self.sv_estimator is None or self.sv_estimator.n_beds != len(vitals):
+            self.sv_estimator = StrokeVolumeEstimator(n_beds=len(vitals), sv_prior=self.estimated_sv)
+        if reference_sv is not None:
+            self.sv_estimator.calibrate(reference_sv)
+        sv = self.sv_estimator.update(vitals[:, 0], vitals[:, 1], pulse_pressure)
+        return self.validate_batch(vitals, sv=sv)
+
+    def validate_trend_batch(self, vitals, pulse_pressure=None):
+        """
+        Stateful ward mode: track_batch() plus rolling SVR / residual trends.
+        Returns (valid, severity, trend_severity, reason_code, svr, co).
+        """
+        valid, severity, codes, svr, co = self.track_batch(vitals, pulse_pressure)
+        if self.trend_monitor is None or len(self.trend_monitor.svr[self.trend_windows[-1]].mean) != len(svr):
+            self.trend_monitor = PhysicsTrendMonitor(len(svr), self.trend_windows)
+        trend_severity = self.trend_monitor.update(svr, self.sv_estimator.baseline_svr)
+        return valid, severity, trend_severity, codes, svr, co
+
+    @staticmethod
+    def explain(code, svr=np.nan):
+        """
+        Human-readable reason for one (code, SVR) pair, same wording as validate().
+        """
+        if code == REASON_IMPOSSIBLE_BP:
+            return "Impossible BP"
+        if code == REASON_IMPOSSIBLE_HR:
+            return "Impossible HR"
+        if code == REASON_ZERO_CO:
+            return "Zero Cardiac Output"
+        if code == REASON_SVR_IMPOSSIBLE:
+            return f"Physics Violation (SVR={svr:.0f} impossible)"
+        return f"Valid (SVR={svr:.0f})"
 
 if __name__ == "__main__":
     pinn = HemodynamicPINN()
@@ -82,3 +437,71 @@ if __name__ == "__main__":
     for label, data in tests:
         valid, score, reason = pinn.validate(np.array(data))
         print(f"[{label}] -> Valid: {valid}, Health Score: {score:.2f}, Note: {reason}")
+
+    # Batch API: same answers, one vectorized call
+    batch = np.array([data for _, data in tests], dtype=float)
+    valid, severity, codes, svr, co = pinn.validate_batch(batch)
+    for (label, data), v, sev, c, r in zip(tests, valid, severity, codes, svr):
+        ref_valid, ref_score, ref_reason = pinn.validate(np.array(data))
+        assert v == ref_valid and np.isclose(sev, ref_score) and pinn.explain(c, r) == ref_reason
+
+    # Whole ward / recording in one call vs a Python loop
+    rng = np.random.default_rng(0)
+    ward = np.column_stack([rng.uniform(5, 320, 100000), rng.uniform(5, 320, 100000)])
+    start = time.perf_counter()
+    for row in ward:
+        pinn.validate(row)
+    loop_ms = (time.perf_counter() - start) * 1e3
+    start = time.perf_counter()
+    pinn.validate_batch(ward)
+    batch_ms = (time.perf_counter() - start) * 1e3
+    result = PhysicsResult()
+    start = time.perf_counter()
+    for row in ward:
+        pinn.validate(row, out=result)
+    reuse_ms = (time.perf_counter() - start) * 1e3
+    print(f"\nvalidate x {len(ward)}: {loop_ms:.0f} ms (reused PhysicsResult: {reuse_ms:.0f} ms) | validate_batch: {batch_ms:.1f} ms")
+
+    # Per-patient SV: a 64-bed ward where each patient's SV, SVR and PP->SV gain differ
+    # from the population (70 ml, 1000, 70/40), and SV drifts +/-15% over the run
+    n_beds, n_ticks = 64, 3000
+    sv_start = rng.uniform(50, 100, n_beds)
+    true_sv = sv_start * (1 + rng.uniform(-0.15, 0.15, n_beds) * np.linspace(0, 1, n_ticks)[:, None])
+    true_svr = rng.uniform(800, 1400, n_beds)
+    true_gain = rng.uniform(1.2, 2.5, n_beds) # ml per mmHg, patient compliance
+    hr = 75 + rng.normal(0, 2, (n_ticks, n_beds))
+    map_bp = hr * true_sv * true_svr / 80000 + rng.normal(0, 2, (n_ticks, n_beds))
+    pp_noise = rng.normal(0, 2, (n_ticks, n_beds))
+    cases = [
+        ("no PP (app / CSVs)", None, False),
+        ("PP, gain = 70/40 for all", 70 / 40, False),
+        ("PP, gain = 50/70 for all", 50 / 70, False),
+        ("PP, per-patient gain", None, False),
+        ("PP, per-patient gain, reference SV at t=0", None, True),
+    ]
+    print(f"\nPer-patient SV, {n_beds} beds x {n_ticks} ticks (fixed 70 ml: "
+          f"{np.abs(70 - true_sv[-1]).mean():.1f} ml mean |SV error|)")
+    for label, gain, calibrated in cases:
+        pinn = HemodynamicPINN()
+        pp = None if label.startswith("no PP") else true_sv / (true_gain if gain is None else gain) + pp_noise
+        start = time.perf_counter()
+        for t in range(n_ticks):
+            ref = sv_start if calibrated and t == 0 else None
+            pinn.track_batch(np.column_stack([hr[t], map_bp[t]]), pulse_pressure=None if pp is None else pp[t],
+                             reference_sv=ref)
+        tick_us = (time.perf_counter() - start) / n_ticks * 1e6
+        sv_err = np.abs(pinn.sv_estimator.sv - true_sv[-1]).mean()
+        print(f"[{label}] mean |SV error| {sv_err:.1f} ml ({tick_us:.0f} us/tick)")
+
+    # Trends: bed 0 has a 5 s MAP artifact, bed 1 a sustained SVR collapse
+    trend_pinn = HemodynamicPINN()
+    n_ticks = 900
+    hr = np.full((n_ticks, 2), 80.0) + rng.normal(0, 1, (n_ticks, 2))
+    map_bp = np.full((n_ticks, 2), 85.0) + rng.normal(0, 1, (n_ticks, 2))
+    map_bp[600:605, 0] = 40.0
+    map_bp[600:, 1] -= np.linspace(0, 40, n_ticks - 600)
+    for t in range(n_ticks):
+        valid, severity, trend_severity, codes, svr, co = trend_pinn.validate_trend_batch(
+            np.column_stack([hr[t], map_bp[t]]))
+        if t in (602, 700, 899):
+            print(f"t={t}: instantaneous severity {np.round(severity, 2)}, trend severity {np.round(trend_severity, 2)}")
@@ -0,0 +1,281 @@
+import time
+import threading
+from collections import deque, namedtuple
+from types import MappingProxyType
+
+import numpy as np
+
+from mock_stream import VitalStream
+from pipeline import TPTPipeline, shape_description
+
+# One published frame of pipeline state. Every field is immutable (tuples,
+# read-only arrays, mapping proxies), so the UI can hold it while the worker moves on.
+Snapshot = namedtuple("Snapshot", [
+    "seq",              # increments on every publish
+    "tick",             # ticks computed so far
+    "vitals",           # {"HR", "MAP", "SpO2", "RR"} of the latest tick
+    "shape_score",
+    "risk_score",
+    "physics_valid",
+    "display_decision", # decision after real-inference override and alert latching
+    "is_analyzing",     # real inference in flight
+    "trigger",          # label of the latest inference trigger (or None)
+    "trigger_seq",      # increments on every trigger, so the UI can toast once
+    "history",          # {"HR", "MAP", "Shape", "Risk", "RR"} -> tuple of the last N ticks
+    "cloud",            # read-only copy of the TDA point cloud
+    "ticks_per_s",      # compute rate: 1 / EWMA of active per-tick time (pauses and pacing excluded)
+    "done",             # stream exhausted
+])
+
+class SnapshotBuffer:
+    def __init__(self):
+        """
+        Double buffer for Snapshots: the worker fills the back slot, then flips the
+        front index. Readers always get the newest complete snapshot without a lock
+        and never observe a half-written frame (snapshots are immutable and the
+        flip is a single attribute store).
+        """
+        self._slots = [None, None]
+        self._front = 0
+
+    def publish(self, snapshot):
+        back = 1 - self._front
+        self._slots[back] = snapshot
+        self._front = back
+
+    def read(self):
+        return self._slots[self._front]
+
+class PipelineWorker:
+    HISTORY = 100
+    INFERENCE_COOLDOWN = 8.0   # s between real-inference triggers
+    RESULT_HOLD = 15.0         # s a real-inference result overrides the simulated decision
+    ALERT_LATCH = 5.0          # s a RED/ORANGE decision stays on screen
+    RATE_ALPHA = 0.05          # EWMA weight of the newest tick in the compute rate
+
+    def __init__(self, csv_path="data/mock_vitals_v2.csv", tick_delay=0.08, auto_risk=0.6, pipeline=None,
+                 idle_timeout=5.0, idle_stop=300.0):
+        """
+        Runs the TPT pipeline on a background thread, decoupled from rendering.
+
+        Each tick: pipeline step, real-inference triggering (auto on risk > `auto_risk`,
+        or a manual request), the UI's alert latching, then one immutable Snapshot
+        published to `buffer`. The UI only reads `buffer.read()` at its own frame
+        rate, so a slow chart never delays the next TDA tick, and no thread other
+        than the script thread touches Streamlit state.
+
+        Starts paused; resume()/pause() gate ticking, stop() ends the thread.
+
+        The reader must call heartbeat() every frame. With no heartbeat for
+        `idle_timeout` s (e.g. the browser tab closed mid-run) the worker pauses
+        itself, so no ticks and no real-inference triggers run for nobody; after
+        `idle_stop` s without a heartbeat the thread exits and `expired` is set.
+        """
+        self.stream = VitalStream(csv_path=csv_path)
+        self.pipeline = pipeline or TPTPipeline()
+        self.agent = self.pipeline.agent
+        self.tick_delay = tick_delay
+        self.auto_risk = auto_risk
+        self.auto_analysis = True
+        self.buffer = SnapshotBuffer()
+
+        self.history = {key: deque(maxlen=self.HISTORY) for key in ("HR", "MAP", "Shape", "Risk", "RR")}
+        self._seq = 0
+        self._running = threading.Event()
+        self._stop = threading.Event()
+        self.idle_timeout = idle_timeout
+        self.idle_stop = idle_stop
+        self._last_heartbeat = time.monotonic()
+        self.expired = False
+
+        # Real inference state, written by the inference thread under the lock
+        self._lock = threading.Lock()
+        self._is_analyzing = False
+        self._analysis_result = None
+        self._manual_request = False
+        self._last_trigger_time = 0.0
+        self._trigger = None
+        self._trigger_seq = 0
+
+        # Alert latching
+        self._latched_decision = None
+        self._last_alert_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def heartbeat(self):
+        self._last_heartbeat = time.monotonic()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def resume(self):
+        self.heartbeat()
+        self._running.set()
+
+    def pause(self):
+        self._running.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._running.set()
+        self._thread.join()
+
+    def request_analysis(self):
+        with self._lock:
+            self._manual_request = True
+
+    def _wait_active(self):
+        """
+        Block while paused. Returns False when the thread should exit
+        (stop(), or no heartbeat for `idle_stop` s).
+        """
+        while not self._stop.is_set():
+            idle = time.monotonic() - self._last_heartbeat
+            if self._running.is_set():
+                if idle <= self.idle_timeout:
+                    return True
+                self._running.clear() # Reader gone: pause until the next resume()
+            if idle > self.idle_stop:
+                self.expired = True
+                return False
+            self._running.wait(timeout=1.0)
+        return False
+
+    def _run(self):
+        tick_time = None # EWMA of active seconds per tick
+        for chunk in self.stream.stream(chunk_size=1):
+            if not self._wait_active():
+                return
+            tick_start = time.perf_counter()
+
+            row = chunk.iloc[0]
+            vitals = row[["HR", "MAP", "SpO2", "Temp", "RR"]].to_numpy(dtype=float)
+            ctx = self.pipeline.step(vitals, timestamp=row["timestamp"])
+
+            self._maybe_trigger(ctx)
+            display_decision = self._display_decision(ctx["agent"])
+
+            # Only this tick's own work counts: time paused or pacing never enters the rate
+            elapsed = time.perf_counter() - tick_start
+            tick_time = elapsed if tick_time is None else tick_time + self.RATE_ALPHA * (elapsed - tick_time)
+            self._publish(row, ctx, display_decision, 1.0 / max(tick_time, 1e-9), done=False)
+
+            # Pace like the live monitor; rendering never adds to this
+            remaining = self.tick_delay - (time.perf_counter() - tick_start)
+            if remaining > 0:
+                self._stop.wait(remaining)
+            if self._stop.is_set():
+                return
+
+        last = self.buffer.read()
+        if last is not None:
+            self.buffer.publish(last._replace(seq=last.seq + 1, done=True))
+
+    def _maybe_trigger(self, ctx):
+        with self._lock:
+            triggers = []
+            if self._manual_request:
+                triggers.append("Manual")
+            if self.auto_analysis and ctx["kan"].risk > self.auto_risk:
+                triggers.append("Auto-Risk")
+            if not triggers or self._is_analyzing:
+                return
+            if time.time() - self._last_trigger_time <= self.INFERENCE_COOLDOWN:
+                return
+            self._manual_request = False
+            self._is_analyzing = True
+            self._last_trigger_time = time.time()
+            self._trigger = triggers[0]
+            self._trigger_seq += 1
+
+        # The RiskResult is refilled next tick: hand the thread its formatted explanation
+        vitals = ctx["vitals"]
+        args = (ctx["kan"].risk, ctx["pinn"].is_valid, ctx["kan"].explanation,
+                shape_description(ctx["tda"]), ctx["snapshot"], ctx["tda"], (vitals[0], vitals[1], vitals[4]))
+        threading.Thread(target=self._analyze, args=args, daemon=True).start()
+
+    def _analyze(self, risk_score, physics_valid, formula, shape_desc, snapshot, shape_score, vitals):
+        result = self.agent.evaluate(risk_score, physics_valid, formula, run_real_inference=True,
+                                     shape_desc=shape_desc, vitals_snapshot=snapshot,
+                                     shape_score=shape_score, vitals=vitals)
+        with self._lock:
+            self._analysis_result = result
+            self._is_analyzing = False
+
+    def _display_decision(self, decision):
+        # Hysteresis: a recent real-inference result wins, then latched alerts
+        now = time.time()
+        with self._lock:
+            if self._analysis_result and now - self._last_trigger_time < self.RESULT_HOLD:
+                return self._analysis_result
+        if decision["risk_state"] in ("RED", "ORANGE"):
+            self._latched_decision = decision
+            self._last_alert_time = now
+            return decision
+        if now - self._last_alert_time < self.ALERT_LATCH and self._latched_decision:
+            return self._latched_decision
+        return decision
+
+    def _publish(self, row, ctx, display_decision, ticks_per_s, done):
+        shape_score, risk_score = ctx["tda"], ctx["kan"].risk
+        hist = self.history
+        hist["HR"].append(row["HR"])
+        hist["MAP"].append(row["MAP"])
+        hist["Shape"].append(shape_score)
+        hist["Risk"].append(risk_score)
+        hist["RR"].append(row["RR"])
+
+        cloud = np.array(self.pipeline.tda.point_cloud)
+        cloud.flags.writeable = False
+        with self._lock:
+            is_analyzing, trigger, trigger_seq = self._is_analyzing, self._trigger, self._trigger_seq
+
+        self._seq += 1
+        self.buffer.publish(Snapshot(
+            seq=self._seq,
+            tick=self.pipeline.n_ticks,
+            vitals=MappingProxyType({key: row[key] for key in ("HR", "MAP", "SpO2", "RR")}),
+            shape_score=shape_score,
+            risk_score=risk_score,
+            physics_valid=ctx["pinn"].is_valid,
+            display_decision=MappingProxyType(dict(display_decision)),
+            is_analyzing=is_analyzing,
+            trigger=trigger,
+            trigger_seq=trigger_seq,
+            history=MappingProxyType({key: tuple(values) for key, values in hist.items()}),
+            cloud=cloud,
+            ticks_per_s=ticks_per_s,
+            done=done,
+        ))
+
+if __name__ == "__main__":
+    # Compute rate with a deliberately slow reader: the reader must not slow the worker
+    worker = PipelineWorker(tick_delay=0.0)
+    worker.auto_analysis = False
+    worker.resume()
+    frames, last_seq = 0, -1
+    start = time.perf_counter()
+    while time.perf_counter() - start < 3.0:
+        worker.heartbeat()
+        snap = worker.buffer.read()
+        if snap is not None and snap.seq != last_seq:
+            last_seq = snap.seq
+            frames += 1
+            time.sleep(0.05) # a slow "render"
+    worker.stop()
+    snap = worker.buffer.read()
+    print(f"Worker: {snap.tick} ticks at {snap.ticks_per_s:.0f} ticks/s | reader: {frames} frames "
+          f"(~20 fps) | latest risk {snap.risk_score:.2f}, state {snap.display_decision['risk_state']}")
+
+    # Reader disappears (tab closed): the worker pauses itself, then exits
+    worker = PipelineWorker(tick_delay=0.0, idle_timeout=0.5, idle_stop=2.0)
+    worker.auto_analysis = False
+    worker.resume()
+    time.sleep(1.0)
+    ticks = worker.buffer.read().tick
+    time.sleep(0.5)
+    print(f"No heartbeat: stopped ticking at tick {ticks} (still {worker.buffer.read().tick} 0.5 s later)", end="")
+    time.sleep(2.5)
+    print(f", expired after idle_stop: {worker.expired} (thread alive: {worker.is_alive()})")
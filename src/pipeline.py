@@ -0,0 +1,296 @@
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from layer_1_tda import TopologicalSensor, StageTimings
+from layer_2_pinn import HemodynamicPINN, PhysicsResult
+from layer_3_kan import PhysicsInformedKAN, RiskResult
+from layer_4_agent import MedGemmaAgent
+
+class LayerGraph:
+    def __init__(self, max_workers=2):
+        """
+        Per-tick layer pipeline declared as a dependency graph (DAG).
+
+        Each stage is `fn(ctx) -> result`, where `ctx` holds the tick inputs plus the
+        results of every upstream stage by name. Stages whose dependencies are met
+        run concurrently: all but one go to a thread pool and one runs inline on the
+        calling thread, so a chain of single stages never pays a thread hop.
+        `max_workers=0` runs the stages serially in declaration order (the baseline).
+
+        Every tick records per-stage latency, the tick's critical-path latency
+        (wall time from tick start to the last stage finishing) and the serial sum
+        of stage times, in a StageTimings histogram.
+        """
+        self.stages = {}
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers) if max_workers else None
+        self.timings = StageTimings()
+        self.last_spans = {}
+
+    def add(self, name, fn, deps=()):
+        """
+        Declare a stage. Dependencies must be declared first (keeps the graph acyclic).
+        """
+        missing = [d for d in deps if d not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on undeclared stages {missing}")
+        self.stages[name] = (fn, tuple(deps))
+        return self
+
+    def _run_stage(self, name, ctx):
+        start = time.perf_counter()
+        result = self.stages[name][0](ctx)
+        self.last_spans[name] = (start, time.perf_counter())
+        return result
+
+    def run(self, **inputs):
+        """
+        One tick. Returns the context dict (inputs + every stage's result).
+        """
+        ctx = dict(inputs)
+        self.last_spans = {}
+        tick_start = time.perf_counter()
+
+        if self.executor is None:
+            for name in self.stages:
+                ctx[name] = self._run_stage(name, ctx)
+        else:
+            waiting = {name: set(deps) for name, (fn, deps) in self.stages.items()}
+            futures = {}
+            while waiting or futures:
+                ready = [name for name, deps in waiting.items() if not deps]
+                for name in ready:
+                    del waiting[name]
+                for name in ready[1:]:
+                    futures[self.executor.submit(self._run_stage, name, ctx)] = name
+
+                # 1. One ready stage inline, the rest in the pool
+                finished = []
+                if ready:
+                    ctx[ready[0]] = self._run_stage(ready[0], ctx)
+                    finished.append(ready[0])
+                elif futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = futures.pop(future)
+                        ctx[name] = future.result()
+                        finished.append(name)
+
+                # 2. Release dependants
+                for name in finished:
+                    for deps in waiting.values():
+                        deps.discard(name)
+
+        tick_end = time.perf_counter()
+        for name, (start, end) in self.last_spans.items():
+            self.timings.record(name, end - start)
+        self.timings.record("critical_path", tick_end - tick_start)
+        self.timings.record("serial_sum", sum(end - start for start, end in self.last_spans.values()))
+        return ctx
+
+    def critical_path(self):
+        """
+        Stage chain that bounds the last tick's latency: the longest path through
+        the DAG weighted by each stage's measured duration. Independent of how the
+        stages were scheduled, so serial runs report the same chain as parallel ones.
+        """
+        if not self.last_spans:
+            return []
+        # Declaration order is topological: one pass of longest-path DP
+        best = {}
+        for name, (fn, deps) in self.stages.items():
+            start, end = self.last_spans[name]
+            prev = max(deps, key=lambda d: best[d][0], default=None)
+            best[name] = ((best[prev][0] if prev else 0.0) + end - start, prev)
+        name = max(best, key=lambda s: best[s][0])
+        path = []
+        while name is not None:
+            path.append(name)
+            name = best[name][1]
+        return path[::-1]
+
+    def report(self):
+        return self.timings.report()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+def shape_description(shape_score):
+    if shape_score > 2.0:
+        return f"EXPLODING (Radius {shape_score:.2f}). Variance High."
+    return f"Stable (Radius {shape_score:.2f})"
+
+def build_tpt_graph(tda=None, pinn=None, kan=None, agent=None, max_workers=2):
+    """
+    The Layer 1-4 tick as a DAG: TDA and PINN are independent and joined before
+    the KAN; the (simulation) agent decision follows the KAN.
+    Tick inputs: `vitals` (HR, MAP, SpO2, Temp, RR) and `snapshot` (text for the agent).
+    """
+    tda = tda or TopologicalSensor()
+    pinn = pinn or HemodynamicPINN()
+    kan = kan or PhysicsInformedKAN()
+    agent = agent or MedGemmaAgent()
+    physics, risk = PhysicsResult(), RiskResult()
+
+    graph = LayerGraph(max_workers=max_workers)
+    graph.add("tda", lambda ctx: tda.update(ctx["vitals"]))
+    graph.add("pinn", lambda ctx: pinn.validate(ctx["vitals"], out=physics))
+    graph.add("kan", lambda ctx: kan.predict_risk(ctx["tda"], ctx["pinn"].severity, out=risk),
+              deps=("tda", "pinn"))
+    graph.add("agent", lambda ctx: agent.evaluate(ctx["kan"].risk, ctx["pinn"].is_valid, ctx["kan"],
+                                                  shape_desc=shape_description(ctx["tda"]),
+                                                  vitals_snapshot=ctx["snapshot"]),
+              deps=("tda", "pinn", "kan"))
+    return graph
+
+class TPTPipeline:
+    ALERT_STATES = ("YELLOW", "ORANGE", "RED")
+
+    def __init__(self, tda=None, pinn=None, kan=None, agent=None, max_workers=0, alert_threshold=0.6):
+        """
+        Headless Layer 1-4 loop: no Streamlit, no session state, no rendering.
+
+        step() pushes one tick of vitals through the layer DAG (build_tpt_graph) and
+        returns the tick context (tda score, PhysicsResult, RiskResult, agent decision).
+        replay() drives a recording through step() as fast as possible or paced
+        at N x real time, and summarises throughput, per-layer latency and alerts.
+
+        An alert is a transition of the agent's risk_state into YELLOW / ORANGE / RED;
+        `alert_threshold` marks the risk level that would trigger real inference
+        (the app's Auto-Copilot), recorded as a separate event.
+        """
+        self.tda = tda or TopologicalSensor()
+        self.pinn = pinn or HemodynamicPINN()
+        self.kan = kan or PhysicsInformedKAN()
+        self.agent = agent or MedGemmaAgent()
+        self.graph = build_tpt_graph(self.tda, self.pinn, self.kan, self.agent, max_workers=max_workers)
+        self.alert_threshold = alert_threshold
+        self.n_ticks = 0
+        self.alerts = []
+        self._state = "GREEN"
+        self._above_threshold = False
+
+    def step(self, vitals, timestamp=None):
+        """
+        One tick of vitals (HR, MAP, SpO2, Temp, RR). Returns the tick context.
+        """
+        arrival = time.perf_counter()
+        snapshot = f"HR {vitals[0]:.0f}, MAP {vitals[1]:.0f}, RR {vitals[4]:.0f}"
+        ctx = self.graph.run(vitals=vitals, snapshot=snapshot)
+        latency_ms = (time.perf_counter() - arrival) * 1e3
+
+        # Alert bookkeeping: only transitions are recorded
+        state = ctx["agent"]["risk_state"]
+        if state in self.ALERT_STATES and state != self._state:
+            self._record_alert(state, ctx, timestamp, latency_ms)
+        self._state = state
+        above = ctx["kan"].risk > self.alert_threshold
+        if above and not self._above_threshold:
+            self._record_alert("INFERENCE_TRIGGER", ctx, timestamp, latency_ms)
+        self._above_threshold = above
+
+        self.n_ticks += 1
+        return ctx
+
+    def _record_alert(self, kind, ctx, timestamp, latency_ms):
+        self.alerts.append({
+            "tick": self.n_ticks,
+            "timestamp": self.n_ticks if timestamp is None else timestamp,
+            "kind": kind,
+            "risk": ctx["kan"].risk,
+            "latency_ms": latency_ms,
+        })
+
+    def replay(self, csv_path, speed=None, max_ticks=None):
+        """
+        Replay a vitals CSV (timestamp column in seconds). speed=None runs as fast
+        as possible; speed=N paces ticks at N x real time and reports how far
+        processing lagged behind the schedule.
+        """
+        import pandas as pd # only replays read CSVs
+        df = pd.read_csv(csv_path)
+        if max_ticks is not None:
+            df = df.iloc[:max_ticks]
+        vitals = df[["HR", "MAP", "SpO2", "Temp", "RR"]].to_numpy(dtype=float)
+        timestamps = df["timestamp"].to_numpy(dtype=float) if "timestamp" in df else np.arange(len(df), dtype=float)
+
+        max_lag = 0.0
+        start = time.perf_counter()
+        for row, ts in zip(vitals, timestamps):
+            if speed:
+                due = start + (ts - timestamps[0]) / speed
+                wait_s = due - time.perf_counter()
+                if wait_s > 0:
+                    time.sleep(wait_s)
+                else:
+                    max_lag = max(max_lag, -wait_s)
+            self.step(row, timestamp=ts)
+        wall = time.perf_counter() - start
+
+        return {
+            "ticks": len(vitals),
+            "wall_s": wall,
+            "ticks_per_s": len(vitals) / wall if wall > 0 else float("inf"),
+            "max_lag_ms": max_lag * 1e3,
+            "layers": self.graph.report(),
+            "alerts": list(self.alerts),
+        }
+
+    def shutdown(self):
+        self.graph.shutdown()
+
+def run_replay(csv_path, speed=None, max_ticks=None, max_workers=0):
+    pipeline = TPTPipeline(max_workers=max_workers)
+    summary = pipeline.replay(csv_path, speed=speed, max_ticks=max_ticks)
+    pipeline.shutdown()
+
+    pace = f"{speed:g}x real time" if speed else "as fast as possible"
+    print(f"Replayed {summary['ticks']} ticks ({pace}) in {summary['wall_s']:.2f} s: "
+          f"{summary['ticks_per_s']:.0f} ticks/s, max lag {summary['max_lag_ms']:.1f} ms")
+    for stage, r in summary["layers"].items():
+        print(f"  {stage:<14} p50 {r['p50_ms']:.3f} ms | p95 {r['p95_ms']:.3f} ms | p99 {r['p99_ms']:.3f} ms")
+    print(f"{len(summary['alerts'])} alert events")
+    for kind in TPTPipeline.ALERT_STATES + ("INFERENCE_TRIGGER",):
+        events = [a for a in summary["alerts"] if a["kind"] == kind]
+        if events:
+            print(f"  {kind:<18} x{len(events):<4} first at t={events[0]['timestamp']:.0f} s, "
+                  f"p95 decision latency {np.percentile([a['latency_ms'] for a in events], 95):.2f} ms")
+    for alert in summary["alerts"][:5]:
+        print(f"  t={alert['timestamp']:.0f} s (tick {alert['tick']}): {alert['kind']}, "
+              f"risk {alert['risk']:.2f}, decided {alert['latency_ms']:.2f} ms after arrival")
+    return summary
+
+def run_dag_comparison(csv_path, max_ticks=1000):
+    import pandas as pd
+    vitals = pd.read_csv(csv_path)[["HR", "MAP", "SpO2", "Temp", "RR"]].to_numpy()[:max_ticks]
+    for label, workers in (("serial", 0), ("concurrent", 2)):
+        graph = build_tpt_graph(max_workers=workers)
+        for row in vitals:
+            graph.run(vitals=row, snapshot=f"HR {row[0]:.0f}, MAP {row[1]:.0f}, RR {row[4]:.0f}")
+        report = graph.report()
+        print(f"\n[{label}] critical path: {' -> '.join(graph.critical_path())}")
+        for stage in ("tda", "pinn", "kan", "agent", "serial_sum", "critical_path"):
+            r = report[stage]
+            print(f"  {stage:<14} p50 {r['p50_ms']:.3f} ms | p95 {r['p95_ms']:.3f} ms")
+        graph.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless TPT pipeline (Layers 1-4)")
+    parser.add_argument("command", choices=["replay", "dag"],
+                        help="replay: run a CSV through the pipeline; dag: serial vs concurrent layer latency")
+    parser.add_argument("--csv", default="data/mock_vitals_v2.csv")
+    parser.add_argument("--ticks", type=int, default=None)
+    parser.add_argument("--speed", type=float, default=None,
+                        help="Pace at N x real time (default: as fast as possible)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Thread pool size for independent layers (0 = serial)")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        run_replay(args.csv, speed=args.speed, max_ticks=args.ticks, max_workers=args.workers)
+    elif args.command == "dag":
+        run_dag_comparison(args.csv, max_ticks=args.ticks or 1000)
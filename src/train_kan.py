@@ -0,0 +1,68 @@
+import re
+import json
+import time
+import argparse
+import numpy as np
+
+from layer_2_pinn import HemodynamicPINN
+from layer_3_kan import PhysicsInformedKAN
+
+def load_distillation_jsonl(path="data/medgemma_physics_distillation.jsonl"):
+    """
+    Turns the Physics-Distillation corpus back into KAN training triples.
+    Each entry's prompt carries HR / MAP / ShapeScore and its completion the
+    teacher's Risk_Calculation; the physics score is recomputed with the PINN.
+    Returns (shape_scores, physics_scores, risk) arrays.
+    """
+    pinn = HemodynamicPINN()
+    pattern = re.compile(r"HR=(-?\d+), MAP=(-?\d+)\. ShapeScore=(\d+(?:\.\d+)?)")
+    vitals, shape, risk = [], [], []
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            match = pattern.search(entry["input"])
+            if not match:
+                continue
+            hr, map_bp, shape_score = (float(v) for v in match.groups())
+            vitals.append([hr, map_bp])
+            shape.append(shape_score)
+            risk.append(float(json.loads(entry["output"])["Risk_Calculation"].rstrip("%")) / 100)
+
+    valid, physics, codes, svr, co = pinn.validate_batch(np.array(vitals))
+    return np.array(shape), physics, np.array(risk)
+
+def synthetic_samples(n_samples, noise=0.02, seed=0):
+    """
+    Labels from the current (pre-trained) KAN plus noise, for throughput checks.
+    """
+    rng = np.random.default_rng(seed)
+    shape = rng.uniform(0, 5, n_samples)
+    physics = rng.uniform(0, 1, n_samples)
+    risk = PhysicsInformedKAN().predict_risk_batch(shape, physics) + rng.normal(0, noise, n_samples)
+    return shape, physics, risk
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit monotone KAN spline coefficients")
+    parser.add_argument("--jsonl", default="data/medgemma_physics_distillation.jsonl")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Fit on N synthetic samples instead of the JSONL corpus")
+    parser.add_argument("--out", default="data/kan_coeffs.npz")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        shape, physics, risk = synthetic_samples(args.synthetic)
+    else:
+        shape, physics, risk = load_distillation_jsonl(args.jsonl)
+    print(f"Fitting KAN on {len(risk)} samples...")
+
+    kan = PhysicsInformedKAN()
+    start = time.perf_counter()
+    rmse = kan.fit(shape, physics, risk)
+    print(f"Fit in {time.perf_counter() - start:.3f} s, RMSE={rmse:.4f}")
+    print(f"Shape edge coeffs:   {np.round(kan.shape_spline.coeffs, 3)}")
+    print(f"Physics edge coeffs: {np.round(kan.physics_spline.coeffs, 3)}")
+
+    kan.save(args.out)
+    reloaded = PhysicsInformedKAN(coeffs_path=args.out)
+    assert np.array_equal(reloaded.predict_risk_batch(shape, physics), kan.predict_risk_batch(shape, physics))
+    print(f"Saved to {args.out}")